@@ -0,0 +1,167 @@
+import hashlib
+import math
+import numpy as np
+from qgram import normalize_value
+
+"""
+Per-table Bloom filters over the keywords and textual cell values of each table.
+A filter answers whether a table *might* contain a term, with no false negatives,
+which allows whole tables to be pruned before any row-level query is run
+against the (much larger) keyword and cell B-trees.
+
+Our schema is as follows:
+
+table_blooms(table_id, num_bits, num_hashes, num_items, fp_rate, bits)
+"""
+
+FP_RATE = 0.01
+
+
+def build_bloom_filters(conn, fp_rate=FP_RATE):
+    """
+    Builds a Bloom filter for every table in the database from the
+    'keywords_cell_header', 'keywords_title_caption' and 'cells' tables.
+    Any previous filters are replaced.
+
+    Arguments:
+    conn: The connection to the database
+    fp_rate: The target false-positive rate of each filter
+    """
+    c = conn.cursor()
+
+    c.execute("DROP TABLE IF EXISTS table_blooms;")
+    c.execute("""CREATE TABLE table_blooms(table_id integer, num_bits integer, num_hashes integer,
+                num_items integer, fp_rate real, bits blob,
+                PRIMARY KEY (table_id));""")
+
+    terms = { }
+    for table_id, keyword in c.execute("SELECT table_id, keyword FROM keywords_cell_header;"):
+        terms.setdefault(table_id, set()).add(normalize_value(keyword))
+    for table_id, keyword in c.execute("SELECT table_id, keyword FROM keywords_title_caption;"):
+        terms.setdefault(table_id, set()).add(normalize_value(keyword))
+    for table_id, value in c.execute("""SELECT table_id, value
+                                        FROM cells NATURAL JOIN columns
+                                        WHERE type = 'text'
+                                        AND value != '';"""):
+        terms.setdefault(table_id, set()).add(normalize_value(value))
+
+    numHashes = max(1, round(-math.log2(fp_rate)))
+    blooms = []
+    for table_id, tableTerms in terms.items():
+        tableTerms.discard("")
+        n = len(tableTerms)
+        m = max(64, math.ceil(-n * math.log(fp_rate) / math.log(2) ** 2))
+        m += -m % 8
+
+        bits = np.zeros(m // 8, dtype=np.uint8)
+        if n > 0:
+            pos = positions(*term_hashes(tableTerms), np.array([m]), numHashes).ravel()
+            np.bitwise_or.at(bits, pos >> 3, np.left_shift(1, pos & 7).astype(np.uint8))
+
+        actualRate = (1 - math.exp(-numHashes * n / m)) ** numHashes
+        blooms.append((table_id, m, numHashes, n, actualRate, bits.tobytes()))
+
+    c.executemany("INSERT INTO table_blooms VALUES (?, ?, ?, ?, ?, ?);", blooms)
+    print("Inserted into table_blooms")
+
+    return
+
+
+class BloomFilters():
+    """
+    An instance of this class holds the Bloom filters of every table
+    in the database, packed into a single byte array so that many terms
+    can be checked against all filters in one vectorized pass.
+    """
+
+    def __init__(self, conn, chunkSize=4096):
+        rows = conn.execute("""SELECT table_id, num_bits, num_hashes, bits
+                            FROM table_blooms
+                            ORDER BY table_id;""").fetchall()
+
+        self.tableIDs = np.array([row[0] for row in rows], dtype=np.int64)
+        self.numBits = np.array([row[1] for row in rows], dtype=np.uint64)
+        self.numHashes = np.array([row[2] for row in rows], dtype=np.int64)
+        self.bits = np.frombuffer(b"".join(row[3] for row in rows), dtype=np.uint8)
+        self.offsets = np.zeros(len(rows), dtype=np.uint64)
+        self.offsets[1:] = np.cumsum(self.numBits // np.uint64(8))[:-1]
+        self.chunkSize = chunkSize
+
+    def probe(self, terms):
+        """
+        Checks every term against every table's filter.
+
+        Arguments:
+        - terms: The list of terms (keywords or cell values) to check
+
+        Returns:
+        A boolean matrix of shape (# tables, # terms), where entry [i, j] is
+        False only if table self.tableIDs[i] definitely does not contain terms[j].
+        """
+        terms = [normalize_value(term) for term in terms]
+        result = np.zeros((len(self.tableIDs), len(terms)), dtype=bool)
+        if len(terms) == 0 or len(self.tableIDs) == 0:
+            return result
+
+        h1, h2 = term_hashes(terms)
+
+        # Tables built with different false-positive rates use a different # of hashes
+        for k in np.unique(self.numHashes):
+            group = np.flatnonzero(self.numHashes == k)
+            for start in range(0, len(group), self.chunkSize):
+                tables = group[start: start + self.chunkSize]
+                pos = positions(h1, h2, self.numBits[tables], k)
+                byte = self.bits[self.offsets[tables][:, None, None] + (pos >> np.uint64(3))]
+                isSet = (byte >> (pos & np.uint64(7)).astype(np.uint8)) & 1
+                result[tables] = isSet.all(axis=2)
+
+        return result
+
+    def candidate_tables(self, terms, min_matches=1):
+        """
+        Finds the tables that may contain at least 'min_matches' of 'terms'.
+        All other tables are guaranteed not to, and so can be pruned.
+
+        Arguments:
+        - terms: The list of terms to check
+        - min_matches: The minimum number of terms a table must (possibly) contain
+
+        Returns:
+        The sorted list of candidate table ids
+        """
+        matches = self.probe(terms).sum(axis=1)
+        return self.tableIDs[matches >= min_matches].tolist()
+
+
+def term_hashes(terms):
+    """
+    Hashes every term into the pair of 64-bit values used
+    for double hashing, i.e. the i'th hash of a term is h1 + i * h2.
+
+    Arguments:
+    terms: An iterable of normalized terms
+
+    Returns:
+    Two uint64 arrays, h1 and h2
+    """
+    digests = b"".join(hashlib.blake2b(term.encode("utf-8"), digest_size=16).digest() for term in terms)
+    hashes = np.frombuffer(digests, dtype="<u8").reshape(-1, 2)
+    return hashes[:, 0], hashes[:, 1] | np.uint64(1)
+
+
+def positions(h1, h2, numBits, numHashes):
+    """
+    Computes the bit positions of every term in every filter.
+
+    Arguments:
+    h1, h2: The hashes of the terms from 'term_hashes'
+    numBits: The number of bits of each filter
+    numHashes: The number of hashes used by the filters
+
+    Returns:
+    A uint64 array of shape (# filters, # terms, numHashes)
+    """
+    i = np.arange(numHashes, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        pos = h1[None, :, None] + i[None, None, :] * h2[None, :, None]
+    return pos % numBits.astype(np.uint64)[:, None, None]
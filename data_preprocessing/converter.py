@@ -8,6 +8,23 @@ import itertools
 import operator
 
 
+def string_dtype():
+    """
+    The dtype in which the cells are stored: Arrow-backed strings where pyarrow
+    is installed and usable, otherwise Python strings. pyarrow can be installed
+    but fail to load (i.e. when built against another version of NumPy), so
+    an Arrow array is built rather than only importing pyarrow.
+    """
+    try:
+        pd.array([""], dtype="string[pyarrow]")
+        return "string[pyarrow]"
+    except Exception:
+        return object
+
+
+STRING_DTYPE = string_dtype()
+
+
 class Converter():
     """ 
     An instance of this class represents a Converter used to convert
@@ -28,7 +45,7 @@ class Converter():
             self.nestedHeaders = [0]
             self.captions = []
             self.title = f' { os.path.split(os.path.splitext(filepath)[0])[-1] }'
-        self.noHeaders = None
+        self.headerRows = None
         self.sep = '"'
 
     def makeTable(self, data, filepath):
@@ -41,6 +58,9 @@ class Converter():
 
         Returns:
         - dataframe of read-in data, whether or not it is a multi-frame (hardcoded to False)
+
+        Every cell is stored as a string. Where pyarrow is installed the columns
+        are Arrow-backed, which takes a fraction of the memory of Python strings.
         """
         if filepath is None:
             df = pd.DataFrame.from_dict(data['rows'])
@@ -49,8 +69,9 @@ class Converter():
         elif os.path.splitext(filepath)[1] == '.csv':
             df = pd.read_csv(filepath, header=None)
 
-        df = df.applymap(lambda x: str(x))
-        df = df.replace(to_replace=self.null, value="")
+        # Convert one column at a time, so that only a single column is ever held twice
+        for column in df.columns:
+            df[column] = df[column].map(str).replace(to_replace=self.null, value="").astype(STRING_DTYPE)
         return df, False
 
     def validateColumns(self):
@@ -68,20 +89,19 @@ class Converter():
         Number of columns in the table.
         """
         removed = 0
-        withHeaders = self.df.copy()
-        self.df.drop(self.nestedHeaders, inplace=True)
+        # The header rows are kept in the table, but are not validated
+        body = ~self.df.index.isin(self.nestedHeaders)
         if not self.isMultiIndex:
-            for column in self.df.columns:
-                col = self.df[column]
+            for column in list(self.df.columns):
+                col = self.df[column][body]
                 if any([
                     self.isEmpty(col),
                     self.isAppropSize(col),
                     self.isPuncCol(col),
                     self.isImageCol(col),
                 ]):
-                    withHeaders.drop(column, axis=1, inplace=True)
+                    self.df.drop(column, axis=1, inplace=True)
                     removed += 1
-        self.df = withHeaders
         return removed
 
     def isEmpty(self, col):
@@ -175,7 +195,7 @@ class Converter():
 
                 newNestedHeaders = self.df[columnName][self.nestedHeaders]
                 self.df.set_index(columnName, drop=True, inplace=True)
-                self.noHeaders = self.df.drop(newNestedHeaders, axis='index').copy()
+                self.headerRows = self.df.index.isin(newNestedHeaders)
                 break
         else:
             # No break occurred, which implies no valid key column exists
@@ -219,9 +239,7 @@ class Converter():
         Returns:
         - None
         """
-        for col in self.noHeaders:
-            self.noHeaders[col] = pd.to_numeric(self.noHeaders[col], errors='ignore')
-        types = ['object'] + list(map(str, self.noHeaders.dtypes.values))
+        types = ['object'] + [self.getType(self.df[col][~self.headerRows]) for col in self.df.columns]
 
         file.write("title: {0}\n".format(self.title))
         file.write("types: {0}\n".format(', '.join(types)))
@@ -232,7 +250,7 @@ class Converter():
         for cap in self.captions:
             file.write("caption: {0}\n".format(cap))
 
-        for idx, row in self.df.iterrows():
+        for idx, *row in self.df.itertuples(name=None):
             file.write(f'{self.sep}{idx}{self.sep}')
             for cell in row:
                 file.write(f', {self.sep}{cell}{self.sep}')
@@ -244,6 +262,22 @@ class Converter():
 
         return
 
+    def getType(self, col):
+        """
+        Determines the type of a column, ignoring its headers
+
+        Arguments:
+        - col: The column to be analyzed
+
+        Returns:
+        The dtype of the column once converted to numbers ('int64' or 'float64'),
+        or 'object' if the column is not numeric
+        """
+        try:
+            return str(pd.to_numeric(col.astype(object)).dtype)
+        except (ValueError, TypeError):
+            return 'object'
+
     def getDimensions(self):
         """
         Returns the dimensions of the table
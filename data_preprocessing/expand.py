@@ -0,0 +1,862 @@
+import sqlite3
+import argparse
+import json
+import math
+import os
+import re
+import sys
+from multiprocessing import Pool
+from pathlib import Path
+import numpy as np
+from scipy import stats
+from scipy.optimize import linear_sum_assignment
+from qgram import levenshtein
+from fingerprints import value_hash
+
+"""
+Offline, batch version of the set expansion ('xr') performed by the server in
+program/server/data/db.js. Each seed set is expanded with the same pipeline as
+Database.xr():
+
+getMatchingTables -> getTextualMatches -> getNumericalMatches
+    -> getNULLMatches -> getPermutedRows -> rankResults
+
+The columns of the database are loaded once per worker process, so that the
+overlap similarities and Welch's t-tests between a seed set column and *every*
+column of the database are computed as single NumPy / SciPy operations. The
+linear program used to map columns is replaced by an assignment solver, and
+many seed sets are expanded in parallel across cores.
+
+Seed sets are read as JSON lines with the same fields as the '/api/results/seed-set'
+and '/api/results/dot-op' routes:
+
+{"tableIDs": [...], "rowIDs": [...], "sliders": [...], "unique": [...], "rowsReturned": 10}
+
+'sliders', 'unique' and 'rowsReturned' are optional (default 50 for every column, none, and 10).
+For each seed set, a JSON line {"rows": [...], "info": [...]} is written in the same order,
+or {"error": "..."} if the seed set could not be expanded. Sliders beyond the number
+of columns of the seed set are ignored.
+
+The results are meant to be identical to the server's, so its quirks are reproduced
+rather than corrected:
+- The text filter of getMatchingTables is skipped when the first textual column has
+  exactly 2 values, and no table matches when no textual column has a non-zero slider.
+- The numerical overlap of getMatchingTables compares the seed values, as formatted by
+  javascript's String(Number(value)), with the text of the cells (so "15.60" does not
+  match 15.6), while getNumericalMatches compares numbers.
+- If a table has too few unused columns for the NULL columns of the seed set, the
+  server's query for its rows fails, and the whole expansion returns no rows.
+- If every row of the candidate tables is NULL in a column, the average length in
+  BS25 is 0 and the scores of the column are NaN, so its rows keep their order.
+
+With --dedup, rows which repeat a seed row or a row of an earlier candidate table are
+dropped before ranking, by comparing the fingerprints in 'value_hashes' rather than the
+text of the rows. This changes the scores of the remaining rows, and so the results
+differ from the server's, which only removes repeated rows after ranking.
+"""
+
+cellSep = " || "
+jsNumber = re.compile(r"^[+-]?(?:(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?|Infinity)$")
+minLogP = math.log(1e-300)
+
+
+def main():
+    filepath = os.path.dirname(os.path.realpath(__file__))
+    db_name = os.path.join(Path(filepath).parent, 'program', 'server', 'data', 'database.db')
+
+    parser = argparse.ArgumentParser(description="Expand many seed sets offline.")
+    parser.add_argument("seeds", help="JSON lines file of seed sets")
+    parser.add_argument("output", help="JSON lines file to write the expanded rows to")
+    parser.add_argument("--db", default=db_name, help="path to database.db")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--dedup", action="store_true", help="drop repeated rows before ranking")
+    args = parser.parse_args()
+
+    with open(args.seeds, encoding='utf8') as inp:
+        seeds = [json.loads(line) for line in inp if line.strip()]
+
+    failed = 0
+    with open(args.output, 'w', encoding='utf8') as output:
+        for i, result in enumerate(expand_all(args.db, seeds, args.workers, args.dedup)):
+            output.write(json.dumps(result) + "\n")
+            if "error" in result:
+                failed += 1
+            if (i + 1) % 10 == 0:
+                sys.stderr.write('\r{0} seed sets expanded'.format(i + 1))
+                sys.stderr.flush()
+
+    print("\nFinished expanding {0} seed sets".format(len(seeds)))
+    if failed > 0:
+        print("Number of seed sets which failed: {0}".format(failed))
+    return
+
+
+def expand_all(db_name, seeds, workers=None, dedup=False):
+    """
+    Expands every seed set in 'seeds' in parallel.
+
+    Arguments:
+    db_name: The path to the database
+    seeds: A list of seed set dictionaries, as described at the top of this file
+    workers: The number of worker processes
+    dedup: Whether to drop repeated rows before ranking
+
+    Returns:
+    A generator of the expanded rows (or errors), in the same order as 'seeds'
+    """
+    if workers is not None and workers <= 1:
+        expander = Expander(db_name, dedup)
+        for seed in seeds:
+            yield expand_seed(expander, seed)
+        return
+
+    with Pool(workers, initializer=init_worker, initargs=(db_name, dedup)) as pool:
+        yield from pool.imap(expand_worker, seeds, chunksize=4)
+
+
+expander = None
+
+
+def init_worker(db_name, dedup):
+    global expander
+    expander = Expander(db_name, dedup)
+
+
+def expand_worker(seed):
+    return expand_seed(expander, seed)
+
+
+def expand_seed(expander, seed):
+    """
+    Expands a seed set, returning {"error": ...} rather than raising if it
+    fails, so that a single malformed seed set does not stop the whole batch
+    """
+    try:
+        return expander.expand(seed)
+    except Exception as error:
+        return {"error": "{0}: {1}".format(type(error).__name__, error)}
+
+
+class Expander():
+    """
+    An instance of this class holds the columns of the database in memory
+    and expands seed sets against them. All methods mirror the method of the
+    same name in the server's Database class.
+    """
+
+    def __init__(self, db_name, dedup=False):
+        self.dedup = dedup
+        self.conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+        self.rowsReturned = 10
+
+        self.titles = dict(self.conn.execute("SELECT table_id, title FROM titles;"))
+        self.maxCol = dict(self.conn.execute("SELECT table_id, MAX(col_id) FROM cells GROUP BY table_id;"))
+
+        self.typeCounts = { }
+        for table_id, t, count in self.conn.execute("""SELECT table_id, type, COUNT(DISTINCT col_id)
+                                                    FROM columns GROUP BY table_id, type;"""):
+            self.typeCounts[(table_id, t)] = count
+
+        self.loadTextColumns()
+        self.loadNumericalColumns()
+
+    def loadTextColumns(self):
+        """
+        Loads every textual column, building the inverted indices used to
+        compute the overlap of a seed set column with all columns at once.
+        """
+        self.textCols = []  # (table_id, col_id) of each column, by column index
+        self.tableTextCols = { }  # table_id -> column indices, in ascending col_id order
+        members = { }  # value -> column indices containing the value (non-header cells)
+        counts = { }  # value -> {column index: # of cells} (all cells)
+
+        cells = self.conn.execute("""SELECT table_id, col_id, value, location
+                                    FROM cells NATURAL JOIN columns
+                                    WHERE type = 'text'
+                                    AND value != ''
+                                    ORDER BY table_id, col_id;""")
+        colIndex = { }
+        for table_id, col_id, value, location in cells:
+            key = (table_id, col_id)
+            if key not in colIndex:
+                colIndex[key] = len(self.textCols)
+                self.textCols.append(key)
+            idx = colIndex[key]
+
+            valueCounts = counts.setdefault(value, { })
+            valueCounts[idx] = valueCounts.get(idx, 0) + 1
+            if location != 'header':
+                members.setdefault(value, set()).add(idx)
+
+        hasCells = set()
+        for cols in members.values():
+            hasCells.update(cols)
+        for idx in sorted(hasCells):
+            self.tableTextCols.setdefault(self.textCols[idx][0], []).append(idx)
+
+        self.textMembers = {v: np.fromiter(cols, dtype=np.int64) for v, cols in members.items()}
+        self.textCounts = {v: (np.fromiter(c.keys(), dtype=np.int64), np.fromiter(c.values(), dtype=np.int64))
+                           for v, c in counts.items()}
+
+    def loadNumericalColumns(self):
+        """
+        Loads every numerical column, precomputing the statistics
+        needed to run Welch's t-test against all of them at once.
+        """
+        self.numCols = []
+        self.tableNumCols = { }
+        members = { }
+        textMembers = { } # The text of a cell -> column indices, compared as strings by getMatchingTables
+        columns = { }
+
+        cells = self.conn.execute("""SELECT table_id, col_id, value
+                                    FROM cells NATURAL JOIN columns
+                                    WHERE type = 'numerical'
+                                    AND value != ''
+                                    AND location != 'header'
+                                    ORDER BY table_id, col_id, row_id;""")
+        for table_id, col_id, value in cells:
+            column = columns.setdefault((table_id, col_id), [])
+            textMembers.setdefault(value, set()).add(len(columns) - 1)
+            column.append(js_number(value))
+
+        n, mean, var, const, first = [], [], [], [], []
+        for idx, (key, values) in enumerate(columns.items()):
+            self.numCols.append(key)
+            self.tableNumCols.setdefault(key[0], []).append(idx)
+            values = np.array([v for v in values if not math.isnan(v)])
+            for v in set(values.tolist()):
+                members.setdefault(v, []).append(idx)
+
+            n.append(len(values))
+            mean.append(values.mean() if len(values) else np.nan)
+            var.append(values.var(ddof=1) if len(values) > 1 else np.nan)
+            const.append(len(values) > 0 and values.std() == 0)
+            first.append(values[0] if len(values) else np.nan)
+
+        self.numStats = (np.array(n), np.array(mean), np.array(var), np.array(const), np.array(first))
+        self.numMembers = {v: np.array(cols, dtype=np.int64) for v, cols in members.items()}
+        self.numTextMembers = {v: np.fromiter(cols, dtype=np.int64) for v, cols in textMembers.items()}
+
+    def expand(self, seed):
+        """
+        Expands a single seed set, as Database.postSeedSet() followed by
+        Database.handleDotOps('xr', ...) would.
+
+        Arguments:
+        seed: A seed set dictionary, as described at the top of this file
+
+        Returns:
+        Dictionary of the expanded 'rows' and their 'info'
+        """
+        self.postSeedSet(seed["tableIDs"], seed["rowIDs"])
+        self.rowsReturned = int(seed.get("rowsReturned", 10))
+
+        sliders = seed.get("sliders", [])[:self.seedSet["numCols"]]
+        for i, slider in enumerate(sliders):
+            self.seedSet["sliders"][i] = float(slider)
+        self.seedSet["uniqueCols"] = [int(col) - 1 for col in seed.get("unique", [])]
+
+        results = self.xr()
+        fill_nulls(results["rows"], self.seedSet["numCols"])
+        return results
+
+    def postSeedSet(self, tableIDs, rowIDs):
+        """
+        Sets the current seed set from the given rows
+        """
+        pairs = sorted(set(zip(map(int, tableIDs), map(int, rowIDs))))
+        rows = []
+        for table_id, row_id in pairs:
+            cells = self.conn.execute("""SELECT value FROM cells
+                                        WHERE table_id = ? AND row_id = ?
+                                        ORDER BY col_id;""", (table_id, row_id)).fetchall()
+            if len(cells):
+                rows.append(cellSep.join(value or "NULL" for value, in cells))
+
+        numCols = max((len(row.split(cellSep)) for row in rows), default=0)
+        fill_nulls(rows, numCols)
+        types = get_types(rows)
+
+        self.seedSet = {
+            "rows": rows,
+            "numCols": numCols,
+            "types": types,
+            "sliders": [50] * numCols,
+            "uniqueCols": [],
+            "numTextual": types.count("text"),
+            "numNumerical": types.count("numerical"),
+            "numNULL": types.count("NULL"),
+        }
+
+    def xr(self):
+        """
+        Delegates tasks related to the set expansion of seed set rows.
+        """
+        if len(self.seedSet["rows"]) == 0:
+            return {"rows": [], "info": []}
+
+        tables = self.getMatchingTables()
+        tables = self.getTextualMatches(tables)
+        tables = self.getNumericalMatches(tables)
+        tables = self.getNULLMatches(tables)
+        if tables is None:
+            return {"rows": [], "info": []}
+        tables = self.getPermutedRows(tables)
+        return self.rankResults(tables)
+
+    def seedColumns(self, colType):
+        """
+        Gets the non-NULL values and sliders of each seed set column of type 'colType'
+        """
+        rows = [row.split(cellSep) for row in self.seedSet["rows"]]
+        columns = []
+        sliders = []
+        for i, t in enumerate(self.seedSet["types"]):
+            if t != colType:
+                continue
+            columns.append([row[i] for row in rows if row[i] != "NULL"])
+            sliders.append(self.seedSet["sliders"][i])
+        return columns, sliders
+
+    def textOverlap(self, ssCol):
+        """
+        Overlap similarity of 'ssCol' with every textual column
+        """
+        hits = np.zeros(len(self.textCols))
+        for value in ssCol:
+            cols = self.textMembers.get(value)
+            if cols is not None:
+                hits[cols] += 1
+        return hits / len(ssCol)
+
+    def numericalOverlap(self, ssCol, members=None):
+        """
+        Overlap similarity of 'ssCol' with every numerical column, comparing
+        numbers, or the text of the cells if 'members' is 'numTextMembers'
+        """
+        members = self.numMembers if members is None else members
+        hits = np.zeros(len(self.numCols))
+        for value in ssCol:
+            cols = members.get(value)
+            if cols is not None:
+                hits[cols] += 1
+        return hits / len(ssCol)
+
+    def getMatchingTables(self):
+        """
+        Detects the tables which are likely to be related to the seed set,
+        using the first textual and numerical columns with non-zero sliders.
+        """
+        textCols, textSliders = self.seedColumns("text")
+        numCols, numSliders = self.seedColumns("numerical")
+        candidates = None
+
+        first = next((i for i, s in enumerate(textSliders) if s != 0), None)
+        textCol = textCols[first] if first is not None else []
+        # The server treats the values as a stringified array, skipping the filter
+        # when there are 2 values, and matching nothing (value IN ()) when there are none
+        if len(textCol) == 0:
+            candidates = set()
+        elif len(textCol) != 2:
+            threshold = (textSliders[first] / 100) * len(textCol)
+            hits = np.zeros(len(self.textCols), dtype=np.int64)
+            for value in set(textCol):
+                if value in self.textCounts:
+                    cols, counts = self.textCounts[value]
+                    hits[cols] += counts
+
+            passed = {self.textCols[idx][0] for idx in np.flatnonzero(hits >= threshold)}
+            candidates = {t for t in passed
+                          if self.typeCounts.get((t, 'text'), 0) >= self.seedSet["numTextual"]}
+
+        first = next((i for i, s in enumerate(numSliders) if s != 0), None)
+        if first is not None and len(numCols[first]):
+            # The column is passed to SQL as JSON, in which NaN and Infinity are null, and
+            # OVERLAP_SIM compares String(null) or String(number) with the text of the cells
+            numCol = [v if math.isfinite(v) else None for v in map(js_number, numCols[first])]
+            overlap = self.numericalOverlap([js_string(v) for v in numCol], self.numTextMembers)
+            numCol = [0.0 if v is None else v for v in numCol]
+            score = np.maximum(overlap, ttest_cases_batch(numCol, self.numStats))
+            passed = {self.numCols[idx][0] for idx in np.flatnonzero(score >= numSliders[first] / 100)}
+            passed = {t for t in passed
+                      if self.typeCounts.get((t, 'numerical'), 0) >= self.seedSet["numNumerical"]}
+            candidates = passed if candidates is None else candidates & passed
+
+        wide = {t for t, maxCol in self.maxCol.items() if maxCol >= len(self.seedSet["types"]) - 1}
+        candidates = wide if candidates is None else candidates & wide
+
+        return [{"table_id": t} for t in sorted(candidates)]
+
+    def getTextualMatches(self, tables):
+        """
+        Finds the mapping of each table's textual columns to the seed set's
+        textual columns which maximizes the cumulative overlap similarity.
+        A seed set column must overlap the column it is mapped to.
+        """
+        ssCols, _ = self.seedColumns("text")
+        overlaps = np.array([self.textOverlap(col) for col in ssCols]).reshape(len(ssCols), len(self.textCols))
+
+        results = []
+        for table in tables:
+            cols = self.tableTextCols.get(table["table_id"], [])
+            mapping = assign(overlaps[:, cols], [self.textCols[idx][1] for idx in cols])
+            if mapping is None or any(overlaps[i, cols][mapping[2][i]] <= 0 for i in range(len(ssCols))):
+                continue
+            table["textualPerm"], table["textScore"] = mapping[0], mapping[1]
+            results.append(table)
+
+        return results
+
+    def getNumericalMatches(self, tables):
+        """
+        Finds the mapping of each table's numerical columns to the seed set's
+        numerical columns which maximizes the sum of log p-values, where the p-value
+        of a pair of columns is the maximum of overlap similarity and Welch's t-test.
+        The score of the table combines these p-values using Fisher's method.
+        """
+        ssCols, _ = self.seedColumns("numerical")
+        ssCols = [[js_number(v) for v in col] for col in ssCols]
+        if len(ssCols) == 0:
+            for table in tables:
+                table["numericalPerm"] = []
+                table["score"] = table["textScore"]
+            return tables
+
+        with np.errstate(divide='ignore'):
+            logP = np.array([
+                np.log(np.maximum(ttest_cases_batch(col, self.numStats), self.numericalOverlap(col)))
+                if len(col) else np.full(len(self.numCols), -np.inf)
+                for col in ssCols
+            ]).reshape(-1, len(self.numCols))
+        logP = np.nan_to_num(logP, nan=minLogP, neginf=minLogP)
+
+        results = []
+        for table in tables:
+            cols = self.tableNumCols.get(table["table_id"], [])
+            mapping = assign(logP[:, cols], [self.numCols[idx][1] for idx in cols])
+            if mapping is None:
+                continue
+            table["numericalPerm"] = mapping[0]
+            table["score"] = -2 * mapping[1] + table["textScore"]
+            results.append(table)
+
+        return results
+
+    def getNULLMatches(self, tables):
+        """
+        Maps the first unused columns of each table to the seed set's NULL columns.
+
+        Returns:
+        The tables, or None if a table does not have enough unused columns, in which
+        case the server's query for the rows of the table fails and it returns no rows
+        """
+        for table in tables:
+            table["NULLperm"] = []
+            if self.seedSet["numNULL"]:
+                used = set(table["textualPerm"]) | set(table["numericalPerm"])
+                cols = self.conn.execute("""SELECT DISTINCT col_id FROM cells
+                                            WHERE table_id = ?
+                                            ORDER BY col_id;""", (table["table_id"],))
+                table["NULLperm"] = [c for c, in cols if c not in used][:self.seedSet["numNULL"]]
+                if len(table["NULLperm"]) < self.seedSet["numNULL"]:
+                    return None
+        return tables
+
+    def getPermutedRows(self, tables):
+        """
+        Retrieves the rows of each table, with its columns permuted
+        to match the columns of the seed set.
+        """
+        if self.dedup:
+            return self.getUniquePermutedRows(tables)
+
+        for table in tables:
+            perms = {"text": iter(table["textualPerm"]),
+                     "numerical": iter(table["numericalPerm"]),
+                     "NULL": iter(table["NULLperm"])}
+            order = [next(perms[t]) for t in self.seedSet["types"]]
+
+            rows = { }
+            cells = self.conn.execute("""SELECT row_id, col_id, value
+                                        FROM cells
+                                        WHERE table_id = ?
+                                        AND location != 'header';""", (table["table_id"],))
+            for row_id, col_id, value in cells:
+                rows.setdefault(row_id, { })[col_id] = value or "NULL"
+
+            table["rows"] = [cellSep.join(row[col] for col in order if col in row)
+                             for _, row in sorted(rows.items())]
+            table["titles"] = [self.titles.get(table["table_id"], "")] * len(table["rows"])
+
+        return tables
+
+    def getUniquePermutedRows(self, tables):
+        """
+        As getPermutedRows, but each permuted row is reduced to the tuple of its
+        value hashes, and rows whose tuple has already been seen (in the seed set or
+        an earlier table) are dropped. Empty cells are 'NULL' in both, so they match.
+        """
+        seen = {tuple(value_hash(value) for value in row.split(cellSep)) for row in self.seedSet["rows"]}
+
+        for table in tables:
+            perms = {"text": iter(table["textualPerm"]),
+                     "numerical": iter(table["numericalPerm"]),
+                     "NULL": iter(table["NULLperm"])}
+            order = [next(perms[t]) for t in self.seedSet["types"]]
+
+            rows = { }
+            cells = self.conn.execute("""SELECT c.row_id, c.col_id, c.value, h.value_hash
+                                        FROM cells c
+                                        JOIN value_hashes h
+                                        ON h.table_id = c.table_id AND h.row_id = c.row_id AND h.col_id = c.col_id
+                                        WHERE c.table_id = ?
+                                        AND c.location != 'header';""", (table["table_id"],))
+            for row_id, col_id, value, h in cells:
+                rows.setdefault(row_id, { })[col_id] = (value or "NULL", h)
+
+            table["rows"] = []
+            for _, row in sorted(rows.items()):
+                key = tuple(row[col][1] for col in order if col in row)
+                if key in seen:
+                    continue
+                seen.add(key)
+                table["rows"].append(cellSep.join(row[col][0] for col in order if col in row))
+            table["titles"] = [self.titles.get(table["table_id"], "")] * len(table["rows"])
+
+        return tables
+
+    def rankResults(self, tables):
+        """
+        Ranks the rows of the tables by comparing each row with the seed set using the
+        BS25 ranking function for every column, aggregating the ranks with Borda's method.
+        """
+        seedCols = list(zip(*(row.split(cellSep) for row in self.seedSet["rows"])))
+        scores = { }
+        for table in tables:
+            for i, row in enumerate(table["rows"]):
+                table["rows"][i] = row.split(cellSep)
+                scores[f"{table['table_id']}-{i}"] = {"row": table["rows"][i], "title": table["titles"][i], "ranks": []}
+
+        # The server counts every row twice when normalizing the ranks
+        numRows = 2 * len(scores)
+        numNonZeroCols = 0
+
+        for col in range(self.seedSet["numCols"]):
+            if self.seedSet["sliders"][col] == 0:
+                continue
+            numNonZeroCols += 1
+
+            docs = [(row[col] if col < len(row) and row[col] != "NULL" else "", f"{table['table_id']}-{i}")
+                    for table in tables for i, row in enumerate(table["rows"])]
+            results = bs25(docs, list(seedCols[col]), k1=0.01 * self.seedSet["sliders"][col], b=0.3)
+
+            numAfter = len(docs)
+            for ids, _ in results:
+                for id in ids:
+                    scores[id]["ranks"].append(numAfter / numRows)
+                numAfter -= len(ids)
+
+        results = list(scores.values())
+        for res in results:
+            res["score"] = sum(res["ranks"]) / numNonZeroCols if numNonZeroCols else float("nan")
+        results.sort(key=lambda res: -res["score"])
+
+        return self.applyColumnConstraints({
+            "rows": [res["row"] for res in results],
+            "info": ["Title: List of {0}<br>Similarity Score: {1}".format(res["title"].strip(), js_fixed(res["score"]))
+                     for res in results],
+        })
+
+    def applyColumnConstraints(self, rankedRows):
+        """
+        Ensures that each column that the user tagged as 'unique' is actually unique,
+        and each column with 100% stickiness has only the values in the seed set.
+        """
+        uniqueCols = self.seedSet["uniqueCols"]
+        stickyCols = [i for i, s in enumerate(self.seedSet["sliders"]) if s == 100]
+        uniqueSets = [set() for _ in uniqueCols]
+        stickySets = [{row.split(cellSep)[col] for row in self.seedSet["rows"]} for col in stickyCols]
+        seen = set(self.seedSet["rows"])
+        uniqueRows = {"rows": [], "info": []}
+
+        for row, info in zip(rankedRows["rows"], rankedRows["info"]):
+            if len(uniqueRows["rows"]) >= self.rowsReturned:
+                break
+
+            joined = cellSep.join(row)
+            if joined.strip() in seen or "NULL" in row[1:]:
+                continue
+            if any(get(row, col) in uniqueSets[i] for i, col in enumerate(uniqueCols)):
+                continue
+            if not all(get(row, col) in stickySets[i] for i, col in enumerate(stickyCols)):
+                continue
+
+            for i, col in enumerate(uniqueCols):
+                uniqueSets[i].add(get(row, col))
+            seen.add(joined)
+            uniqueRows["rows"].append(joined)
+            uniqueRows["info"].append(info)
+
+        return uniqueRows
+
+
+def assign(scores, colIDs):
+    """
+    Maps every seed set column (row of 'scores') to a distinct table column
+    (column of 'scores'), maximizing the total score.
+
+    Returns:
+    None if there are fewer table columns than seed set columns, otherwise
+    the mapped col_ids, the total score, and the mapped column positions
+    """
+    if scores.shape[0] == 0:
+        return [], 0, []
+    if scores.shape[1] < scores.shape[0]:
+        return None
+    rows, cols = linear_sum_assignment(scores, maximize=True)
+    return [colIDs[c] for c in cols], float(scores[rows, cols].sum()), list(cols)
+
+
+def ttest_cases_batch(arr1, numStats):
+    """
+    Computes the p-value of the server's 'ttestCases' between 'arr1' and every
+    numerical column at once. Welch's t-test is used, unless one of the
+    following cases applies:
+    - Either column is empty: 0
+    - Both columns have one value, or both are constant: 0.99 if their first values are equal, else 0.01
+    - 'arr1' has one value: One-sample t-test of the other column against it
+
+    Arguments:
+    arr1: The list of numbers in the seed set column
+    numStats: (n, mean, var, const, first) arrays of the columns, with var computed with ddof=1
+
+    Returns:
+    Array of p-values, one for each column
+    """
+    n2, mean2, var2, const2, first2 = numStats
+    arr1 = np.array([v for v in arr1 if not math.isnan(v)])
+    p = np.zeros(len(n2))
+    if len(arr1) == 0:
+        return p
+
+    n1 = len(arr1)
+    mean1 = arr1.mean()
+    var1 = arr1.var(ddof=1) if n1 > 1 else np.nan
+    equal = 0.98 * (first2 == arr1[0]) + 0.01
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if n1 == 1:
+            t = (mean2 - arr1[0]) / np.sqrt(var2 / n2)
+            df = n2 - 1
+        else:
+            se1, se2 = var1 / n1, var2 / n2
+            t = (mean1 - mean2) / np.sqrt(se1 + se2)
+            df = (se1 + se2) ** 2 / (se1 ** 2 / (n1 - 1) + se2 ** 2 / (n2 - 1))
+        pTest = 2 * stats.t.sf(np.abs(t), df)
+
+    p = np.where(n2 == 0, 0, np.where(((n1 == 1) & (n2 == 1)) | ((arr1.std() == 0) & const2), equal, pTest))
+    return np.nan_to_num(p, nan=0)
+
+
+def ttest_cases(arr1, arr2):
+    """
+    Computes the server's 'ttestCases' p-value between two lists of numbers
+    """
+    arr2 = np.array([v for v in arr2 if not math.isnan(v)])
+    numStats = (np.array([len(arr2)]),
+                np.array([arr2.mean() if len(arr2) else np.nan]),
+                np.array([arr2.var(ddof=1) if len(arr2) > 1 else np.nan]),
+                np.array([len(arr2) > 0 and arr2.std() == 0]),
+                np.array([arr2[0] if len(arr2) else np.nan]))
+    return float(ttest_cases_batch(arr1, numStats)[0])
+
+
+def bs25(docs, terms, k1, b):
+    """
+    Python version of the server's BS25 ranking function (bs25-sim-search.js).
+
+    Arguments:
+    docs: List of (document, id) pairs
+    terms: The seed set values of the column
+    k1, b: The BS25 parameters
+
+    Returns:
+    List of (ids, score) pairs in descending order of score, where 'ids' are the
+    ids of all documents with identical content
+    """
+    k1 = k1 or 0.5
+    documents = { }
+    avgSims = [0] * len(terms)
+    avgLen = 0
+
+    for doc, id in docs:
+        if doc not in documents:
+            sims = [norm_data(doc, term) for term in terms]
+            documents[doc] = {"ids": [], "sims": sims, "len": len(doc)}
+            avgSims = [a + s for a, s in zip(avgSims, sims)]
+        documents[doc]["ids"].append(id)
+        avgLen += len(doc)
+
+    if len(docs) == 0:
+        return []
+
+    avgSims = [s / len(docs) for s in avgSims]
+    avgLen /= len(docs)
+    idfs = [math.log(1 / (s + 1e-4)) + 1 for s in avgSims]
+
+    results = []
+    for doc in js_key_order(documents):
+        d = documents[doc]
+        total = 0
+        for idf, sim in zip(idfs, d["sims"]):
+            # As in javascript, 0 / 0 is NaN when every document is empty
+            denom = sim + k1 * (1 - b + b * (d["len"] / avgLen if avgLen else float("nan")))
+            total += idf * (k1 + 1) * sim / denom if denom else float("nan")
+        results.append((d["ids"], total))
+
+    results.sort(key=lambda res: -res[1] if not math.isnan(res[1]) else 0)
+    return results
+
+
+def norm_data(a, b):
+    """
+    Similarity between two cells used when ranking rows, as in 'rankResults'
+    """
+    numA, numB = js_number(a), js_number(b)
+    if not math.isnan(numA) and not math.isnan(numB):
+        numA, numB = abs(numA), abs(numB)
+        return (min(numA, numB) + 1e-4) / (max(numA, numB) + 1e-4)
+    if max(len(a), len(b)) == 0:
+        return float("nan")
+    return 1 - levenshtein(a, b) / max(len(a), len(b))
+
+
+def js_number(value):
+    """
+    Converts a string to a number as javascript's Number() would, returning nan if it is not numeric
+    """
+    value = value.strip()
+    if value == "":
+        return 0.0
+    if jsNumber.match(value):
+        return float(value.replace("Infinity", "inf"))
+    return float("nan")
+
+
+def js_key_order(obj):
+    """
+    The order in which javascript iterates the keys of an object:
+    array indices in ascending order, then all other keys in insertion order.
+    """
+    isIndex = lambda k: re.match(r"^(?:0|[1-9]\d*)$", k) is not None and int(k) < 2 ** 32 - 1
+    return sorted((k for k in obj if isIndex(k)), key=int) + [k for k in obj if not isIndex(k)]
+
+
+def js_fixed(value):
+    """
+    Formats a number as +value.toFixed(5) is printed in javascript
+    """
+    if math.isnan(value):
+        return "NaN"
+    return "{0:.5f}".format(value).rstrip("0").rstrip(".")
+
+
+def fill_nulls(table, numCols):
+    """
+    Pad each row in 'table' with NULL until the table is a rectangle.
+    """
+    for i, row in enumerate(table):
+        row = row.split(cellSep)
+        row += ["NULL"] * (numCols - len(row))
+        table[i] = cellSep.join(row)
+
+
+def get_types(table):
+    """
+    Gets the type ('numerical', 'text' or 'NULL') of each column in 'table'
+    """
+    rows = [row.split(cellSep) for row in table]
+    types = []
+    for i in range(len(rows[0]) if rows else 0):
+        column = [row[i] for row in rows if row[i] != "NULL"]
+        if len(column) == 0:
+            types.append("NULL")
+        elif all(not math.isnan(js_number(v)) for v in column):
+            types.append("numerical")
+        else:
+            types.append("text")
+    return types
+
+
+def get(row, col):
+    return row[col] if col < len(row) else None
+
+
+def register_functions(conn):
+    """
+    Registers Python equivalents of the functions the server defines
+    on its database connection: toArr, T_TEST and OVERLAP_SIM.
+
+    Arguments:
+    conn: The connection to the database
+    """
+    class ToArr():
+        def __init__(self):
+            self.array = []
+
+        def step(self, value):
+            self.array.append(value)
+
+        def finalize(self):
+            return json.dumps(self.array)
+
+    def t_test(arr1, arr2):
+        arr1 = [js_number(str(v)) for v in json.loads(arr1)]
+        arr2 = [js_number(str(v)) for v in json.loads(arr2)]
+        return ttest_cases(arr1, arr2)
+
+    def overlap_sim(ssCol, keyCol):
+        ssCol = [js_string(v) for v in json.loads(ssCol)]
+        keyCol = set(json.loads(keyCol))
+        return sum(v in keyCol for v in ssCol) / len(ssCol) if len(ssCol) else float("nan")
+
+    conn.create_aggregate("toArr", 1, ToArr)
+    conn.create_function("T_TEST", 2, t_test, deterministic=True)
+    conn.create_function("OVERLAP_SIM", 2, overlap_sim, deterministic=True)
+
+
+def js_string(value):
+    """
+    Converts a JSON value to a string as javascript's String() would
+    """
+    if value is None:
+        return "null"
+    if not isinstance(value, float):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "Infinity" if value > 0 else "-Infinity"
+    if value == 0:
+        return "0"
+
+    # The shortest digits which round-trip, as javascript, laid out by Number::toString
+    sign = "-" if value < 0 else ""
+    mantissa, _, exponent = repr(abs(value)).partition("e")
+    whole, _, fraction = mantissa.partition(".")
+    digits = (whole + fraction).lstrip("0")
+    point = len(whole) + int(exponent or 0) - (len(whole + fraction) - len(digits))
+    digits = digits.rstrip("0")
+    if len(digits) <= point <= 21:
+        return sign + digits + "0" * (point - len(digits))
+    if 0 < point <= 21:
+        return sign + digits[:point] + "." + digits[point:]
+    if -6 < point <= 0:
+        return sign + "0." + "0" * -point + digits
+    mantissa = digits[0] + ("." + digits[1:] if len(digits) > 1 else "")
+    return sign + mantissa + "e" + ("+" if point - 1 >= 0 else "-") + str(abs(point - 1))
+
+
+if __name__ == "__main__":
+    main()
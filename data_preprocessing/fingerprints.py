@@ -0,0 +1,114 @@
+import hashlib
+import struct
+
+"""
+Fingerprints of the rows and cell values of every table. Each cell value is
+hashed to a 64-bit integer, and each row to the hash of its value hashes in
+column order. Rows (or values) that are repeated across tables can then be
+found and removed by comparing integers through an index, rather than by
+comparing the full strings of the rows after they have been ranked.
+
+As on the server, an empty cell is treated as the value 'NULL', and header
+rows are not fingerprinted. Two different values share a hash with
+probability ~2^-64, which is negligible for suppressing duplicates.
+
+Our schema is as follows:
+
+value_hashes(table_id, row_id, col_id, value_hash)
+row_fingerprints(table_id, row_id, row_hash)
+"""
+
+
+def build_fingerprints(conn):
+    """
+    Builds the 'value_hashes' and 'row_fingerprints' tables from the
+    'cells' table. Any previous fingerprints are replaced.
+
+    Arguments:
+    conn: The connection to the database
+    """
+    c = conn.cursor()
+
+    c.execute("DROP TABLE IF EXISTS value_hashes;")
+    c.execute("DROP TABLE IF EXISTS row_fingerprints;")
+
+    c.execute("""CREATE TABLE value_hashes(table_id integer, row_id integer, col_id integer, value_hash integer,
+                PRIMARY KEY (table_id, row_id, col_id)) WITHOUT ROWID;""")
+    c.execute("""CREATE TABLE row_fingerprints(table_id integer, row_id integer, row_hash integer,
+                PRIMARY KEY (table_id, row_id)) WITHOUT ROWID;""")
+
+    rows = []
+    current = None
+    hashes = []
+
+    def values():
+        nonlocal current, hashes
+        # The cells are read in primary key order, so each row's cells are consecutive
+        for table_id, row_id, col_id, value in conn.execute("""SELECT table_id, row_id, col_id, value
+                                                            FROM cells
+                                                            WHERE location != 'header'
+                                                            ORDER BY table_id, row_id, col_id;"""):
+            if (table_id, row_id) != current:
+                if current is not None:
+                    rows.append((*current, row_hash(hashes)))
+                current = (table_id, row_id)
+                hashes = []
+
+            h = value_hash(value)
+            hashes.append(h)
+            yield table_id, row_id, col_id, h
+
+        if current is not None:
+            rows.append((*current, row_hash(hashes)))
+
+    c.executemany("INSERT INTO value_hashes VALUES (?, ?, ?, ?);", values())
+    print("Inserted into value_hashes")
+    c.executemany("INSERT INTO row_fingerprints VALUES (?, ?, ?);", rows)
+    print("Inserted into row_fingerprints")
+
+    c.execute("CREATE INDEX idx_vh_hash ON value_hashes(value_hash);")
+    c.execute("CREATE INDEX idx_rf_hash ON row_fingerprints(row_hash);")
+
+    return
+
+
+def value_hash(value):
+    """
+    Hashes a cell value into a signed 64-bit integer (so that it can be stored
+    as an SQLite integer). Empty cells hash as 'NULL', as they are displayed.
+    """
+    value = value or "NULL"
+    digest = hashlib.blake2b(value.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def row_hash(hashes):
+    """
+    Hashes a row, given the value hashes of its cells in column order
+    """
+    digest = hashlib.blake2b(struct.pack("<{0}q".format(len(hashes)), *hashes), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True)
+
+
+def duplicate_rows(conn):
+    """
+    Finds the rows which are repeated in more than one place in the database
+
+    Arguments:
+    conn: The connection to the database
+
+    Returns:
+    A list of lists of the (table_id, row_id) of each repeated row
+    """
+    groups = { }
+    for h, table_id, row_id in conn.execute("""SELECT row_hash, table_id, row_id
+                                            FROM row_fingerprints
+                                            WHERE row_hash IN (
+                                                SELECT row_hash
+                                                FROM row_fingerprints
+                                                GROUP BY row_hash
+                                                HAVING COUNT(*) > 1
+                                            )
+                                            ORDER BY row_hash, table_id, row_id;"""):
+        groups.setdefault(h, []).append((table_id, row_id))
+    return list(groups.values())
@@ -0,0 +1,348 @@
+import sqlite3
+import argparse
+import asyncio
+import collections
+import csv
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+import numpy as np
+import pipeline
+
+"""
+HTTP load generator and latency benchmark for the results API of the server
+(program/server/routes/api/results.js). It builds a synthetic database.db with
+the preprocessing scripts, starts the server on it, and replays sessions of
+concurrent users, where each session follows the steps of the user interface:
+
+keyword search -> seed-set -> dot-op (initialization) -> dot-op 'xr' (repeated)
+
+Note that the server keeps a single seed set for all users, and so concurrent
+sessions overwrite each other's seed sets; the latencies measured include the
+effect of this contention.
+
+The throughput and the 50th, 95th and 99th percentile latencies of each endpoint are reported.
+"""
+
+API = "/api/results/"
+NOUNS = ["river", "mountain", "lake", "city", "island", "forest", "valley", "harbour", "desert", "plain",
+         "bridge", "tower", "castle", "station", "garden", "market", "museum", "stadium", "airport", "temple"]
+ADJECTIVES = ["north", "south", "east", "west", "great", "little", "old", "new", "upper", "lower",
+              "red", "green", "blue", "white", "black", "golden", "silver", "grand", "royal", "central"]
+CATEGORIES = ["alpha", "beta", "gamma", "delta", "epsilon", "zeta", "theta", "kappa"]
+
+
+def main():
+    filepath = os.path.dirname(os.path.realpath(__file__))
+
+    parser = argparse.ArgumentParser(description="Benchmark the results API of the server under concurrent users.")
+    parser.add_argument("--db", default=None, help="serve an existing database instead of building a synthetic one")
+    parser.add_argument("--tables", type=int, default=200, help="number of synthetic tables")
+    parser.add_argument("--rows", type=int, default=50, help="number of rows of each synthetic table")
+    parser.add_argument("--users", type=int, default=8, help="number of concurrent users")
+    parser.add_argument("--sessions", type=int, default=100, help="total number of sessions")
+    parser.add_argument("--xr", type=int, default=2, help="number of 'xr' expansions per session")
+    parser.add_argument("--port", type=int, default=3001, help="port to start the server on")
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", default=None, help="file to write the results to as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpDir:
+        db_name = args.db
+        if db_name is None:
+            db_name = os.path.join(tmpDir, 'database.db')
+            print("Building synthetic database")
+            make_tables(os.path.join(tmpDir, 'input'), args.tables, args.rows, args.seed)
+            pipeline.run(os.path.join(tmpDir, 'input'), db_name)
+
+        keywords = sample_keywords(db_name)
+
+        server = start_server(os.path.join(Path(filepath).parent, 'program'), os.path.abspath(db_name), args.port)
+        try:
+            asyncio.run(wait_for_server(server, "localhost", args.port))
+            print("Running {0} sessions with {1} concurrent users".format(args.sessions, args.users))
+            stats, duration = asyncio.run(run_sessions("localhost", args.port, keywords,
+                                                        args.users, args.sessions, args.xr, args.seed))
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = summarize(stats, duration)
+    print_report(report, duration)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf8') as out:
+            json.dump(report, out, indent=2)
+
+    return
+
+
+def make_tables(dirStr, numTables, numRows, seed=0):
+    """
+    Writes 'numTables' synthetic .csv files to 'dirStr'. Each table has a textual key column
+    of (mostly) unique names, a textual category column and two numerical columns, drawn
+    from a small vocabulary so that keyword searches and expansions find related tables.
+
+    Arguments:
+    dirStr: The directory to write the files to
+    numTables: The number of tables
+    numRows: The number of rows of each table
+    seed: The random seed
+    """
+    rng = random.Random(seed)
+    os.makedirs(dirStr, exist_ok=True)
+    names = ["{0} {1}".format(adj, noun) for adj in ADJECTIVES for noun in NOUNS]
+
+    for i in range(numTables):
+        noun = rng.choice(NOUNS)
+        with open(os.path.join(dirStr, "{0}s_{1}.csv".format(noun, i)), 'w', newline='', encoding='utf8') as out:
+            writer = csv.writer(out)
+            writer.writerow(["name", "category", "population", "area"])
+            for name in rng.sample(names, min(numRows, len(names))):
+                writer.writerow([name, rng.choice(CATEGORIES), rng.randint(100, 100000), round(rng.uniform(1, 500), 2)])
+    return
+
+
+def sample_keywords(db_name, limit=100):
+    """
+    Returns the most common (non-numerical) keywords of the database,
+    from which the keyword searches of the sessions are drawn
+    """
+    conn = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+    keywords = [row[0] for row in conn.execute("""SELECT keyword
+                                                FROM keywords_cell_header
+                                                WHERE LENGTH(keyword) > 2
+                                                AND keyword GLOB '*[a-z]*'
+                                                GROUP BY keyword
+                                                ORDER BY COUNT(*) DESC, keyword
+                                                LIMIT ?;""", (limit,))]
+    conn.close()
+    return keywords
+
+
+def start_server(programDir, db_name, port):
+    """
+    Starts the server (as 'npm run once' does) on 'port', serving 'db_name'
+
+    Returns:
+    The server's process
+    """
+    env = dict(os.environ, PORT=str(port), BARETQL_DB=db_name)
+    return subprocess.Popen(["node", os.path.join("server", "app.js")], cwd=programDir, env=env)
+
+
+async def wait_for_server(server, host, port, timeout=30):
+    """
+    Waits until the server accepts connections, raising an error
+    if it exits or does not start within 'timeout' seconds
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited with code {0}".format(server.returncode))
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise RuntimeError("The server did not start within {0}s".format(timeout))
+            await asyncio.sleep(0.1)
+
+
+class Client():
+    """
+    An instance of this class is a persistent (keep-alive) HTTP/1.1 connection
+    to the server, as used by a single user. Only GET requests are needed.
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def get(self, path):
+        """
+        Sends a GET request for 'path' and reads the response
+
+        Returns:
+        The status code and body of the response
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        try:
+            self.writer.write("GET {0} HTTP/1.1\r\nHost: {1}:{2}\r\n\r\n".format(path, self.host, self.port).encode('ascii'))
+            await self.writer.drain()
+
+            status = int((await self.reader.readline()).split()[1])
+            headers = { }
+            line = await self.reader.readline()
+            while line not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode('latin-1').partition(":")
+                headers[name.strip().lower()] = value.strip()
+                line = await self.reader.readline()
+
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                body = b""
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                while size > 0:
+                    body += await self.reader.readexactly(size)
+                    await self.reader.readline()
+                    size = int((await self.reader.readline()).split(b";")[0], 16)
+                await self.reader.readline()
+            elif 'content-length' in headers:
+                body = await self.reader.readexactly(int(headers['content-length']))
+            else:
+                body = await self.reader.read()
+                headers['connection'] = 'close'
+        except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+            self.close()
+            raise
+
+        if headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, body
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+
+async def run_sessions(host, port, keywords, users, sessions, xrCount, seed=0):
+    """
+    Runs 'sessions' sessions, with 'users' of them running concurrently
+
+    Arguments:
+    host, port: The address of the server
+    keywords: The keywords from which the searches are drawn
+    users: The number of concurrent users
+    sessions: The total number of sessions
+    xrCount: The number of 'xr' expansions of each session
+    seed: The random seed
+
+    Returns:
+    A dictionary mapping each endpoint to a list of (latency in ms, success),
+    and the duration of the run in seconds
+    """
+    stats = collections.defaultdict(list)
+    remaining = iter(range(sessions))
+
+    async def user(i):
+        rng = random.Random(seed * 1000003 + i)
+        client = Client(host, port)
+        for _ in remaining:
+            try:
+                await session(client, rng, keywords, stats, xrCount)
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                pass # The failed request is recorded by 'request'
+        client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(users)))
+    return stats, time.perf_counter() - start
+
+
+async def request(client, stats, endpoint, path, params):
+    """
+    Sends a request to an endpoint of the API, recording its latency
+
+    Arguments:
+    client: The 'Client' of the user
+    stats: The dictionary of latencies from 'run_sessions'
+    endpoint: The name under which the latency is recorded
+    path: The route, i.e. 'keyword'
+    params: A list of the (name, value) parameters of the query string
+
+    Returns:
+    The body of the response, parsed as JSON if possible
+    """
+    start = time.perf_counter()
+    try:
+        status, body = await client.get("{0}{1}/?{2}".format(API, path, urlencode(params)))
+    except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+        stats[endpoint].append(((time.perf_counter() - start) * 1000, False))
+        raise
+    stats[endpoint].append(((time.perf_counter() - start) * 1000, status == 200))
+
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+
+async def session(client, rng, keywords, stats, xrCount):
+    """
+    Replays a single session of a user: a keyword search, choosing two rows of one
+    of the resulting tables as the seed set, and expanding the seed set 'xrCount' times
+    """
+    searched = rng.sample(keywords, min(2, len(keywords)))
+    rows = await request(client, stats, 'keyword', 'keyword', [('keyword', k) for k in searched])
+    if not isinstance(rows, list) or len(rows) == 0:
+        return
+
+    tables = collections.defaultdict(list)
+    for row in rows:
+        tables[row['table_id']].append(row['row_id'])
+    table_id = rng.choice(sorted(tables))
+    rowIDs = rng.sample(tables[table_id], min(2, len(tables[table_id])))
+
+    await request(client, stats, 'seed-set', 'seed-set',
+                  [('tableIDs', table_id) for _ in rowIDs] + [('rowIDs', row_id) for row_id in rowIDs])
+
+    seedSet = await request(client, stats, 'dot-op', 'dot-op',
+                            [('dotOp', 'undefined'), ('sliders', ''), ('unique', ''), ('rowsReturned', 10)])
+    sliders = seedSet.get('sliders', []) if isinstance(seedSet, dict) else []
+
+    for _ in range(xrCount):
+        await request(client, stats, 'dot-op (xr)', 'dot-op',
+                      [('dotOp', 'xr')] + [('sliders', s) for s in sliders or ['']] + [('unique', ''), ('rowsReturned', 10)])
+    return
+
+
+def summarize(stats, duration):
+    """
+    Computes the throughput and latency percentiles of each endpoint
+
+    Returns:
+    A dictionary mapping each endpoint to its # of 'requests' and 'errors', its
+    throughput ('rps') and its 'p50', 'p95' and 'p99' latencies in ms
+    """
+    report = { }
+    for endpoint, results in stats.items():
+        latencies = [latency for latency, _ in results]
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        report[endpoint] = {
+            'requests': len(results),
+            'errors': sum(not success for _, success in results),
+            'rps': len(results) / duration,
+            'p50': p50,
+            'p95': p95,
+            'p99': p99,
+        }
+    return report
+
+
+def print_report(report, duration):
+    """
+    Prints the results of 'summarize'
+    """
+    total = sum(r['requests'] for r in report.values())
+    print("\n{0} requests in {1:.2f}s ({2:.1f} requests/s)".format(total, duration, total / duration if duration else 0))
+    print("{0:<12} {1:>8} {2:>7} {3:>9} {4:>10} {5:>10} {6:>10}".format(
+        "endpoint", "requests", "errors", "req/s", "p50 (ms)", "p95 (ms)", "p99 (ms)"))
+    for endpoint, r in report.items():
+        print("{0:<12} {1:>8} {2:>7} {3:>9.1f} {4:>10.2f} {5:>10.2f} {6:>10.2f}".format(
+            endpoint, r['requests'], r['errors'], r['rps'], r['p50'], r['p95'], r['p99']))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,26 @@
 import sqlite3
 from pathlib import Path
+from multiprocessing import Pool
+import argparse
+import locale
+import io
 import re
+import heapq
+import itertools
+import collections
+import pickle
+import shutil
 import ftfy
+import functools
+import numpy as np
+import pandas as pd
 import sys
 import os
+import uuid
+import qgram
+import bloom
+import numeric
+import fingerprints
 
 """
 This program transforms the content of txtFiles/output.txt into a 
@@ -18,131 +35,604 @@ captions(table_id, caption)
 columns(table_id, col_id, type)
 keywords_cell_header(keyword, table_id, row_id, col_id, location)
 keywords_title_caption(table_id, location, keyword)
+text_values(value_id, value, num_grams)
+value_trigrams(gram, value_id)
+text_value_cells(value_id, table_id, row_id, col_id)
+table_blooms(table_id, num_bits, num_hashes, num_items, fp_rate, bits)
+numeric_values(value, table_id, col_id, rounded)
+value_hashes(table_id, row_id, col_id, value_hash)
+row_fingerprints(table_id, row_id, row_hash)
+build_info(key, value)
+positions_cell_header(keyword, table_id, row_id, col_id, position, location)
+positions_title_caption(keyword, table_id, location, position)
+
+The last two tables are only created with --positions.
 """
+
+BATCH_SIZE = 16
+RUN_CHUNK = 4096
+FAN_IN = 64
+IN_FLIGHT = 2
+
+# The index of the table_id in the rows under each key of a table returned by 'parse_table'
+TABLE_ID_INDEX = {'cells': 0, 'titles': 0, 'captions': 0, 'columns': 0, 'kwCellHeader': 1,
+                  'kwTitleCaption': 0, 'posCellHeader': 1, 'posTitleCaption': 1}
+
+FILE_PATTERN = re.compile(r"^File:.*?\.\w{3}$")
+WORD_SEPARATOR = re.compile(r'[ _]+')
+WORD_CACHE = 2 ** 16
+
+
 def main():
     filepath = os.path.dirname(os.path.realpath(__file__)) # Get location of current file
     db_name = os.path.join(Path(filepath).parent, 'program', 'server', 'data', 'database.db')
 
-    try:
-        os.remove(db_name)
-    except FileNotFoundError:
-        pass
+    parser = argparse.ArgumentParser(description="Convert tmp/output.txt into database.db.")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes parsing output.txt in parallel")
+    parser.add_argument("--batch-size", type=float, default=BATCH_SIZE, help="MB of output.txt inserted per transaction")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run instead of starting over")
+    parser.add_argument("--positions", action="store_true", help="also build the positional index used for phrase queries")
+    args = parser.parse_args()
+
+    if not args.resume:
+        try:
+            os.remove(db_name)
+        except FileNotFoundError:
+            pass
     conn = sqlite3.connect(db_name)
-
     c = conn.cursor()
 
+    if get_build_info(c, 'offset') is None:
+        # Nothing to resume, e.g. the run was interrupted before the first commit
+        for table in c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%';").fetchall():
+            c.execute('DROP TABLE "{0}";'.format(table[0]))
+        create_tables(c, args.positions)
+        set_build_info(c, offset=0, table_num=0, positions=int(args.positions))
+        conn.commit()
+    elif get_build_info(c, 'complete'):
+        print("The database is already complete")
+        conn.close()
+        return
+    else:
+        print("Resuming after table {0}".format(get_build_info(c, 'table_num')))
+
+    inputPath = os.path.join(filepath, "tmp", "output.txt")
+    offset = get_build_info(c, 'offset')
+    table_num = get_build_info(c, 'table_num')
+    positions = bool(get_build_info(c, 'positions')) # As chosen when the build was started
+
+    # The keyword rows of each batch are spilled to sorted runs rather than inserted
+    runs = SortedRuns(os.path.join(filepath, "tmp", "runs"))
+    runs.discard(offset)
+
+    # Perform insertions, committing the progress along with each batch
+    print("\nInserting into database")
+    for tables, end in parse_batches(inputPath, offset, table_num, args.workers, int(args.batch_size * 2 ** 20), positions):
+        insert_tables(c, tables, positions=positions, runs=runs, batch=end)
+        table_num += len(tables)
+        set_build_info(c, offset=end, table_num=table_num)
+        conn.commit()
+        sys.stderr.write('\r{0} tables added into the database'.format(table_num))
+        sys.stderr.flush()
+
+    print("\n{0} tables added into the database".format(table_num))
+    if not get_build_info(c, 'merged'):
+        runs.merge(c, positions, verbose=True)
+        set_build_info(c, merged=1)
+        conn.commit()
+    runs.clear()
+    build_indices(conn)
+    set_build_info(c, complete=1)
+
+    print("Finished creating database")
+
+    conn.commit()
+    conn.close()
+
+    return
+
+
+def get_build_info(c, key):
+    """
+    Returns the value of 'key' in the 'build_info' table, or None if
+    it (or the table) does not exist
+    """
+    try:
+        row = c.execute("SELECT value FROM build_info WHERE key = ?;", (key,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row is not None else None
+
+
+def set_build_info(c, **info):
+    """
+    Sets the values of the keys in 'info' in the 'build_info' table. The
+    values are committed in the same transaction as the rows they describe.
+    """
+    c.executemany("INSERT OR REPLACE INTO build_info VALUES (?, ?);", info.items())
+    return
+
+
+def parse_batches(inputPath, offset=0, table_num=0, workers=1, batchSize=BATCH_SIZE * 2 ** 20, positions=False):
+    """
+    Parses the tables in output.txt from byte 'offset' onwards, in batches of
+    about 'batchSize' bytes. The file is split into byte ranges that each start on
+    a 'title:' line, and the tables of each range are numbered after those of all
+    preceding ranges, so that the tables are numbered exactly as when output.txt
+    is read from start to end. With more than one worker, the ranges are parsed
+    in parallel, at most IN_FLIGHT ranges per worker ahead of the consumer.
+
+    Arguments:
+    inputPath: The path to output.txt
+    offset: The byte offset of the first table to parse, which must start a table
+    table_num: The # of tables before 'offset'
+    workers: The number of processes
+    batchSize: The approximate # of bytes of each batch
+    positions: Whether to record the position of each keyword
+
+    Returns:
+    A generator of (tables, end), in order of table number, where 'tables' is the
+    list of tables returned by 'parse_table' and 'end' is the byte offset after the batch
+    """
+    size = os.path.getsize(inputPath)
+    numRanges = max(workers * 4, -(-(size - offset) // max(batchSize, 1)))
+    ranges = split_ranges(inputPath, numRanges, offset)
+
+    if workers > 1:
+        with Pool(workers) as pool:
+            # At most IN_FLIGHT ranges per worker are parsed ahead of the consumer, so that the
+            # memory used stays bounded by the batch size. The tables of a range are numbered
+            # from 1 by the worker, and renumbered here in order.
+            pending = collections.deque()
+            ranges = iter(ranges)
+            for start, end in itertools.islice(ranges, workers * IN_FLIGHT):
+                pending.append((end, pool.apply_async(parse_range, ((inputPath, start, end, 0, positions),))))
+
+            while pending:
+                end, result = pending.popleft()
+                tables = result.get()
+                for start, nextEnd in itertools.islice(ranges, 1):
+                    pending.append((nextEnd, pool.apply_async(parse_range, ((inputPath, start, nextEnd, 0, positions),))))
+
+                tables = [renumber_table(table, table_num + i) for i, table in enumerate(tables, 1)]
+                table_num += len(tables)
+                yield tables, end
+    else:
+        for start, end in ranges:
+            tables = parse_range((inputPath, start, end, table_num, positions))
+            table_num += len(tables)
+            yield tables, end
+
+
+def split_ranges(inputPath, numRanges, offset=0):
+    """
+    Splits output.txt from byte 'offset' onwards into at most 'numRanges' byte ranges
+    of similar size, moving each boundary forward to the start of the next 'title:' line.
+
+    Returns:
+    A list of (start, end) byte offsets
+    """
+    size = os.path.getsize(inputPath)
+    bounds = [offset]
+    with open(inputPath, 'rb') as inp:
+        for i in range(1, numRanges):
+            inp.seek(max(offset + (size - offset) * i // numRanges, bounds[-1]))
+            inp.readline() # Skip the (partial) line at the offset
+            pos = inp.tell()
+            line = inp.readline()
+            while line and not line.startswith(b"title"):
+                pos = inp.tell()
+                line = inp.readline()
+            if line and pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def read_range(inputPath, start, end):
+    """
+    Reads the text of output.txt between two byte offsets, decoded and with
+    newlines translated as when output.txt is opened in text mode
+    """
+    with open(inputPath, 'rb') as inp:
+        inp.seek(start)
+        data = inp.read(end - start)
+    return io.StringIO(data.decode(locale.getpreferredencoding(False)), newline=None)
+
+
+def parse_range(args):
+    """
+    Parses the tables in a byte range of output.txt, numbering
+    them from 'base' + 1.
+
+    Arguments:
+    args: (inputPath, start, end, base, positions)
+    """
+    inputPath, start, end, base, positions = args
+    return [parse_table(lines, base + i, positions) for i, lines in enumerate(read_tables(read_range(inputPath, start, end)), 1)]
+
+
+def create_tables(c, positions=False):
+    """
+    Creates the tables of the schema described above, excluding
+    the indices which are built by 'build_indices'
+
+    Arguments:
+    c: The cursor of the database
+    positions: Whether to create the tables of the positional index
+    """
     c.execute("""CREATE TABLE cells(table_id integer, row_id integer, col_id integer, value text, location text,
                 PRIMARY KEY (table_id, row_id, col_id));""")
-    cells = { }
 
     c.execute("""CREATE TABLE titles(table_id integer, title text,
                 PRIMARY KEY (table_id));""")
-    titles = { }
 
     c.execute("""CREATE TABLE captions(table_id integer, caption text,
                 PRIMARY KEY (table_id));""")
-    captions = { }
 
     c.execute("""CREATE TABLE columns(table_id integer, col_id integer, type varchar,
                     PRIMARY KEY (table_id, col_id));""")
-    columns = { }
 
     """ No longer using, uncomment if using """
     # c.execute("""CREATE TABLE headers(table_id integer, row_id integer, col_id integer, header text,
     #             PRIMARY KEY (table_id, row_id, col_id));""")
-    headers = set() # Set of row ids identified to be headers
 
     c.execute("""CREATE TABLE keywords_cell_header(keyword varchar, table_id integer, row_id integer, col_id integer, location varchar,
                 PRIMARY KEY (keyword, table_id, row_id, col_id));""")
-    kwCellHeader = { }
 
     c.execute("""CREATE TABLE keywords_title_caption(table_id integer, location varchar, keyword varchar,
                 PRIMARY KEY (table_id, location, keyword));""")
+
+    c.execute("""CREATE TABLE build_info(key varchar, value,
+                PRIMARY KEY (key));""")
+
+    if positions:
+        c.execute("""CREATE TABLE positions_cell_header(keyword varchar, table_id integer, row_id integer, col_id integer,
+                    position integer, location varchar,
+                    PRIMARY KEY (keyword, table_id, row_id, col_id, position)) WITHOUT ROWID;""")
+
+        c.execute("""CREATE TABLE positions_title_caption(keyword varchar, table_id integer, location varchar, position integer,
+                    PRIMARY KEY (keyword, table_id, location, position)) WITHOUT ROWID;""")
+    return
+
+
+def read_tables(inp):
+    """
+    Splits the lines of output.txt into tables. Each table starts
+    with its 'title:' line, and blank lines between tables are skipped.
+
+    Arguments:
+    inp: An iterable of the lines of output.txt
+
+    Returns:
+    A generator of the list of lines of each table
+    """
+    lines = []
+    for line in inp:
+        if re.match(r"^title", line) and len(lines) > 0:
+            yield lines
+            lines = []
+        if len(line.strip()) > 0:
+            lines.append(line)
+    if len(lines) > 0:
+        yield lines
+
+
+def parse_table(lines, table_num, positions=False):
+    """
+    Parses the lines of a single table from output.txt into
+    the rows of each table in the database.
+
+    Arguments:
+    lines: The lines of the table, starting with its title
+    table_num: the table number
+    positions: Whether to record the position of each keyword
+
+    Returns:
+    A dictionary mapping 'cells', 'titles', 'captions', 'columns', 'kwCellHeader'
+    and 'kwTitleCaption' (and 'posCellHeader' and 'posTitleCaption' if 'positions')
+    to the rows to be inserted: a dictionary keyed by the primary key of each row,
+    or for 'kwCellHeader' and 'posCellHeader', a list of distinct rows
+    """
+    cells = { }
+    titles = { }
+    captions = { }
+    columns = { }
+    headers = set() # Set of row ids identified to be headers
+    rows = [] # (row_id, location, cells) of each cell & header row, for 'handle_cell_keywords'
     kwTitleCaption = { }
+    posTitleCaption = { } if positions else None
+    nextPosition = { } # location -> position of the next title or caption keyword
 
-    table_num = 0
     row_id = 0
     location = None
 
-    with open(os.path.join(filepath, "tmp", "output.txt")) as inp:
-        line = inp.readline()
-        while line:
-            line = line.strip()
-            if len(line) == 0:
-                continue
-    
-            if re.match(r"^title", line):
-                if (table_num + 1) % 10 == 0:
-                    sys.stderr.write('\r{0} tables added into the database'.format(table_num + 1))
-                    sys.stderr.flush()
-                headers = set()
-                location = 'title'
-                row_id = -1
-                table_num += 1
-                line = re.sub(r"^title:? ?", "", line)
-                handle_title(titles, table_num, line)
-                line = re.sub(r"^(?:List of )?", "", line)
-                title = line
-
-                # types always comes after title
-                line = re.sub(r"^types:? ?", "", inp.readline().strip())
-
-                line = re.sub(r"(?:int\d+|float\d+)", "numerical", line)
-                line = re.sub(r"object", "text", line)
-                handle_cols(columns, table_num, line.split(", "))
-                
-                line = title
-                
-            elif re.match(r"^caption", line):
-                location = 'caption'
-                row_id -= 1
-                line = re.sub(r"^caption:? *", "", line)
-                if len(line) > 0:
-                    handle_caption(captions, table_num, line)
-        
-            elif re.match(r"^header", line):
-                line = re.sub(r"^header:? ?", "", line)
-                headers.add(int(line))
+    lines = iter(lines)
+    for line in lines:
+        line = line.strip()
+        if len(line) == 0:
+            continue
+
+        if re.match(r"^title", line):
+            location = 'title'
+            row_id = -1
+            line = re.sub(r"^title:? ?", "", line)
+            handle_title(titles, table_num, line)
+            line = re.sub(r"^(?:List of )?", "", line)
+            title = line
+
+            # types always comes after title
+            line = re.sub(r"^types:? ?", "", next(lines).strip())
+
+            line = re.sub(r"(?:int\d+|float\d+)", "numerical", line)
+            line = re.sub(r"object", "text", line)
+            handle_cols(columns, table_num, line.split(", "))
+
+            line = title
+
+        elif re.match(r"^caption", line):
+            location = 'caption'
+            row_id -= 1
+            line = re.sub(r"^caption:? *", "", line)
+            if len(line) > 0:
+                handle_caption(captions, table_num, line)
+
+        elif re.match(r"^header", line):
+            line = re.sub(r"^header:? ?", "", line)
+            headers.add(int(line))
+            continue
+
+        else:
+            location = 'cell' if row_id not in headers else 'header'
+            line = line[1: -1].split('", "')
+            handle_cells(cells, table_num, row_id, line, location)
+
+        if type(line) == list:
+            rows.append((row_id, location, line))
+        elif len(line) > 0:
+            handle_keywords(kwTitleCaption, table_num, location, line.lower(), posTitleCaption, nextPosition)
+        row_id += 1
+
+    kwCellHeader, posCellHeader = handle_cell_keywords(table_num, rows, positions)
+
+    table = {
+        'cells': cells,
+        'titles': titles,
+        'captions': captions,
+        'columns': columns,
+        'kwCellHeader': kwCellHeader,
+        'kwTitleCaption': kwTitleCaption,
+    }
+    if positions:
+        table['posCellHeader'] = posCellHeader
+        table['posTitleCaption'] = posTitleCaption
+    return table
+
+
+def renumber_table(table, table_num):
+    """
+    Moves a table returned by 'parse_table' to the table number 'table_num',
+    for tables parsed before their number is known (i.e. in parallel)
+
+    Returns:
+    The table, with the rows under each key as a list
+    """
+    renumbered = { }
+    for key, rows in table.items():
+        if TABLE_ID_INDEX[key] == 0:
+            renumbered[key] = [(table_num, *row[1:]) for row in table_rows(rows)]
+        else:
+            renumbered[key] = [(row[0], table_num, *row[2:]) for row in table_rows(rows)]
+    return renumbered
+
+
+def insert_tables(c, tables, verbose=False, positions=False, runs=None, batch=None):
+    """
+    Inserts the parsed tables into the database
+
+    Arguments:
+    c: The cursor of the database
+    tables: A list of tables returned by 'parse_table'
+    verbose: Whether to print the progress of the insertions
+    positions: Whether to insert into the positional index
+    runs: If given, the rows of the tables keyed by keyword are spilled to
+        these 'SortedRuns' instead, to be inserted later by 'SortedRuns.merge'
+    batch: The name of the runs of this batch of tables
+    """
+    for key, stmt in insert_statements(positions):
+        rows = (row for table in tables for row in table_rows(table[key]))
+        if runs is not None and key in SORTED_KEYS:
+            runs.spill(key, batch, rows)
+            continue
+        c.executemany(stmt, rows)
+        if verbose:
+            print("Inserted into {0}".format(stmt.split()[2]))
+    return
+
+
+def table_rows(rows):
+    """
+    Returns the rows stored under a key of a table returned by 'parse_table'
+    """
+    return rows.values() if isinstance(rows, dict) else rows
+
+
+def insert_statements(positions=False):
+    """
+    Returns the list of (key, statement) pairs which insert the rows
+    stored under each key of the tables returned by 'parse_table'
+    """
+    statements = [
+        ('cells', "INSERT INTO cells VALUES (?, ?, ?, ?, ?);"),
+        ('titles', "INSERT INTO titles VALUES (?, ?);"),
+        ('captions', "INSERT INTO captions VALUES (?, ?);"),
+        ('columns', "INSERT INTO columns VALUES (?, ?, ?);"),
+        ('kwCellHeader', "INSERT INTO keywords_cell_header VALUES (?, ?, ?, ?, ?);"),
+        ('kwTitleCaption', "INSERT INTO keywords_title_caption VALUES (?, ?, ?);"),
+    ]
+    if positions:
+        statements += [
+            ('posCellHeader', "INSERT INTO positions_cell_header VALUES (?, ?, ?, ?, ?, ?);"),
+            ('posTitleCaption', "INSERT INTO positions_title_caption VALUES (?, ?, ?, ?);"),
+        ]
+    return statements
+
+
+# The keys of the tables whose primary key starts with the keyword, and so whose
+# rows arrive in a random order with respect to the primary key
+SORTED_KEYS = {'kwCellHeader', 'posCellHeader', 'posTitleCaption'}
+
+
+class SortedRuns():
+    """
+    An instance of this class is a directory of sorted runs of keyword rows, used
+    to insert the keyword tables in primary-key order with an external merge sort.
+    Inserted in table order, the keyword rows land all over the primary-key B-tree,
+    causing random writes and page splits; inserted in primary-key order, the
+    B-tree is built by sequential appends, which is faster and leaves fuller pages.
+
+    Each batch of tables is sorted in memory and written as one run per key, so the
+    memory used is bounded by the batch size. Once all batches are spilled, the runs
+    are merged with a k-way merge, at most FAN_IN runs at a time.
+    """
+
+    def __init__(self, runDir):
+        self.runDir = runDir
+        os.makedirs(runDir, exist_ok=True)
+
+    def spill(self, key, batch, rows):
+        """
+        Sorts 'rows' and writes them as the run of 'key' for 'batch'. The run is
+        flushed to disk before returning, so that it survives a crash once the
+        batch is committed.
+
+        Arguments:
+        key: The key of the table, i.e. 'kwCellHeader'
+        batch: The name of the batch, a non-negative integer
+        rows: An iterable of the rows
+        """
+        path = os.path.join(self.runDir, "{0}-{1:015d}.run".format(key, batch))
+        write_run(path, sorted(rows))
+        return
+
+    def runs(self, key):
+        """
+        Returns the paths of the runs of 'key', in order of batch
+        """
+        names = sorted(name for name in os.listdir(self.runDir) if name.startswith(key + "-") and name.endswith(".run"))
+        return [os.path.join(self.runDir, name) for name in names]
+
+    def discard(self, after):
+        """
+        Deletes the runs of every batch after 'after', i.e. those
+        of batches which were never committed
+        """
+        shutil.rmtree(os.path.join(self.runDir, "merge"), ignore_errors=True)
+        for name in os.listdir(self.runDir):
+            if not name.endswith(".run") or int(name[:-4].split("-")[-1]) > after:
+                os.remove(os.path.join(self.runDir, name))
+        return
+
+    def clear(self):
+        """
+        Deletes every run
+        """
+        self.discard(-1)
+        return
+
+    def merge(self, c, positions=False, verbose=False):
+        """
+        Merges the runs of every key and inserts the rows into their tables in
+        primary-key order. The runs are left in place until 'clear' is called,
+        so that the merge can be repeated if it is interrupted before it is committed.
+
+        Arguments:
+        c: The cursor of the database
+        positions: Whether to insert into the positional index
+        verbose: Whether to print the progress of the insertions
+        """
+        mergeDir = os.path.join(self.runDir, "merge")
+        shutil.rmtree(mergeDir, ignore_errors=True)
+        os.makedirs(mergeDir)
+
+        for key, stmt in insert_statements(positions):
+            if key not in SORTED_KEYS:
                 continue
-        
-            else:
-                location = 'cell' if row_id not in headers else 'header'
-                line = line[1: -1].split('", "')
-                handle_cells(cells, table_num, row_id, line, location)
 
-            if type(line) == list:
-                line = list(map(str.lower, line))
-            else:
-                line = line.lower()
+            # Merge in passes of FAN_IN runs, so that the # of open files is bounded
+            paths = self.runs(key)
+            while len(paths) > FAN_IN:
+                merged = []
+                for i in range(0, len(paths), FAN_IN):
+                    path = os.path.join(mergeDir, "{0}-{1}-{2}.run".format(key, len(paths), i))
+                    write_run(path, heapq.merge(*map(read_run, paths[i: i + FAN_IN])))
+                    merged.append(path)
+                paths = merged
 
-            handle_keywords(kwCellHeader, kwTitleCaption, table_num, location, row_id, line)
-            row_id += 1
+            c.executemany(stmt, heapq.merge(*map(read_run, paths)))
+            if verbose:
+                print("Inserted into {0}".format(stmt.split()[2]))
 
-            line = inp.readline()
+        shutil.rmtree(mergeDir)
+        return
 
-    # Perform insertions
-    print("\nInserting into cells")
-    c.executemany("INSERT INTO cells VALUES (?, ?, ?, ?, ?);", cells.values())
-    print("Inserted into cells")
-    c.executemany("INSERT INTO titles VALUES (?, ?);", titles.values())
-    print("Inserted into titles")
-    c.executemany("INSERT INTO captions VALUES (?, ?);", captions.values())
-    print("Inserted into captions")
-    c.executemany("INSERT INTO columns VALUES (?, ?, ?);", columns.values())
-    print("Inserted into columns")
-    c.executemany("INSERT INTO keywords_cell_header VALUES (?, ?, ?, ?, ?);", kwCellHeader.values())
-    print("Inserted into keywords_cell_header")
-    c.executemany("INSERT INTO keywords_title_caption VALUES (?, ?, ?);", kwTitleCaption.values())
-    print("Inserted into keywords_title_caption")
-    print("Creating indices")
-    c.execute("CREATE INDEX idx_kwch_kw ON keywords_cell_header(keyword);")
-    c.execute("CREATE INDEX idx_kwtc_kw ON keywords_title_caption(keyword);")
 
-    print("Finished creating database")
+def write_run(path, rows):
+    """
+    Writes the (sorted) rows to a run file in chunks of RUN_CHUNK rows,
+    so that the run can be read back without holding all of it in memory
+    """
+    tmpPath = path + ".tmp"
+    with open(tmpPath, 'wb') as out:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == RUN_CHUNK:
+                pickle.dump(chunk, out, pickle.HIGHEST_PROTOCOL)
+                chunk = []
+        pickle.dump(chunk, out, pickle.HIGHEST_PROTOCOL)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmpPath, path)
+    return
 
-    conn.commit()
-    conn.close()
 
+def read_run(path):
+    """
+    Returns a generator of the rows of a run file, one chunk at a time
+    """
+    with open(path, 'rb') as inp:
+        while True:
+            try:
+                chunk = pickle.load(inp)
+            except EOFError:
+                return
+            yield from chunk
+
+
+def build_indices(conn):
+    """
+    Creates the indices of the database once all tables are inserted,
+    including the trigram index, Bloom filters, numeric value index
+    and row fingerprints. A new build version is then stamped in 'build_info',
+    which invalidates any results cached by querycache.py.
+
+    Arguments:
+    conn: The connection to the database
+    """
+    c = conn.cursor()
+    print("Creating indices")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_kwch_kw ON keywords_cell_header(keyword);")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_kwtc_kw ON keywords_title_caption(keyword);")
+    print("Building trigram index")
+    qgram.build_trigram_index(conn)
+    print("Building Bloom filters")
+    bloom.build_bloom_filters(conn)
+    print("Building numeric value index")
+    numeric.build_numeric_index(conn)
+    print("Building row fingerprints")
+    fingerprints.build_fingerprints(conn)
+    set_build_info(c, version=uuid.uuid4().hex)
     return
 
 
@@ -202,33 +692,87 @@ def handle_cells(cells, table_num, row_id, line, location):
     return
 
 
-def handle_keywords(kwch, kwtc, table_num, location, row_id, line):
+def handle_cell_keywords(table_num, rows, positions=False):
     """
-    Inserts all keywords in 'line' into the correct keywords
-    table, depending on 'location'.
+    Extracts the keywords of every cell and header of a table at once. The
+    cells are split into words with vectorized string operations, and each
+    distinct word is fixed with 'fixValue' only once, rather than once per
+    occurrence.
+
+    Arguments:
+    table_num: the table number
+    rows: A list of the (row_id, location, cells) of each cell & header row
+    positions: Whether to record the position of each keyword
+
+    Returns:
+    The distinct rows of 'keywords_cell_header', and those of 'positions_cell_header'
+    (or None if not 'positions'), in order of row, column and position
+    """
+    cells = pd.Series([cell.lower() for _, _, line in rows for cell in line], dtype=object)
+    if len(cells) == 0:
+        return [], [] if positions else None
+
+    rowIDs = np.array([row_id for row_id, _, line in rows for _ in line])
+    colIDs = np.array([col for _, _, line in rows for col in range(len(line))])
+    locations = np.array([location for _, location, line in rows for _ in line], dtype=object)
+
+    cells = cells[~cells.str.match(FILE_PATTERN)]
+    words = cells.str.strip(',.').str.split(WORD_SEPARATOR).explode()
+
+    # Two distinct words may be fixed into the same keyword, so the
+    # keywords are factorized again after fixing
+    codes, distinct = pd.factorize(words.to_numpy())
+    fixedCodes, fixed = pd.factorize(np.array([fixWord(word) for word in distinct], dtype=object))
+    codes = fixedCodes[codes]
+
+    # The index of each word is that of its cell, in order,
+    # and so the position of a word is its offset from the cell's first word
+    index = words.index.to_numpy()
+    starts = np.flatnonzero(np.diff(index, prepend=-1))
+    position = np.arange(len(index)) - np.repeat(starts, np.diff(starts, append=len(index)))
+
+    # A keyword is kept once per cell, at its first occurrence
+    _, first = np.unique(codes * len(rowIDs) + index, return_index=True)
+    first.sort()
+
+    kwch = list(zip(fixed[codes[first]].tolist(), [table_num] * len(first), rowIDs[index[first]].tolist(),
+                    colIDs[index[first]].tolist(), locations[index[first]].tolist()))
+    if not positions:
+        return kwch, None
+
+    # The positions within a cell are distinct, and so every word is kept
+    posch = list(zip(fixed[codes].tolist(), [table_num] * len(index), rowIDs[index].tolist(),
+                     colIDs[index].tolist(), position.tolist(), locations[index].tolist()))
+    return kwch, posch
+
+
+def handle_keywords(kwtc, table_num, location, line, postc=None, nextPosition=None):
+    """
+    Inserts all keywords in the title or caption 'line' into the
+    'keywords_title_caption' table
 
     Arguments:
-    kwch: The cell & header keywords dictionary
     kwtc: The title & caption keywords dictionary
     table_num: the table number
-    location: The location of the keyword [cell, title, caption, header]
-    row_id: the row_id of the line
-    line: The list of cells containing the keywords.
+    location: The location of the keyword [title, caption]
+    line: The (lowercased) title or caption
+    postc: The title & caption positions dictionary, or None to not record positions
+    nextPosition: The position of the next keyword of each location, which is updated
     """
-    if location in ['cell', 'header']:
-        for col, cell in enumerate(line):
-            if re.match(r"^File:.*?\.\w{3}$", cell):
-                continue
-            for word in re.split(r'[ _]+', cell.strip(',.')):
-                word = fixValue(word)
+    words = [word for word in WORD_SEPARATOR.split(line) if len(word) > 0]
 
-                kwch[(word, table_num, row_id, col)] = (word, table_num, row_id, col, location)
-    else:
-        for word in re.split(r'[ _]+', line):
-            word = fixValue(word)
+    # A caption may span many lines, which are joined in the 'captions' table,
+    # and so the positions continue from the previous line
+    start = nextPosition.get(location, 0) if nextPosition is not None else 0
+    for position, word in enumerate(words, start):
+        word = fixWord(word)
 
-            kwtc[(table_num, location, word)] = (table_num, location, word)
+        kwtc[(table_num, location, word)] = (table_num, location, word)
+        if postc is not None:
+            postc[(word, table_num, location, position)] = (word, table_num, location, position)
 
+    if nextPosition is not None:
+        nextPosition[location] = start + len(words)
     return
 
 
@@ -236,6 +780,10 @@ def fixValue(string):
     string = ftfy.fix_text(string)
     return string.encode('utf-8', 'surrogateescape').decode('utf-8', 'replace')
 
+
+# The same words recur across many tables, so keywords are fixed through a cache
+fixWord = functools.lru_cache(maxsize=WORD_CACHE)(fixValue)
+
 """
 cells(tableId, rowId, colId, value)
 titles(tableId, title)
@@ -1,66 +1,336 @@
 import os
+import io
 import sys
 import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+from functools import partial
+import multiprocessing.connection
 import converter
 
+CHECKPOINT_INTERVAL = 60
+
 
 def main():
-    with open(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'tmp', 'output.txt'), 'w', encoding='utf8') as output:
-        rowSizes = []
-        colSizes = []
-        allColsRemoved = []
-
-        tableCount = 0
-        successes = 0
-        dirStr = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'input') # Join abs. path of file with input/
-    
-        for subDir, _, files in os.walk(dirStr):
-            for file in files:
-                filename = os.fsdecode(file)
-                if not (filename.endswith(".xlsx") or filename.endswith(".csv")): 
-                    continue
-                tableCount += 1
-                if tableCount % 10 == 0:
-                    sys.stderr.write('\r' + str(tableCount) + " tables analyzed")
-                    sys.stderr.flush()
-
-                table = converter.Converter(filepath=os.path.join(subDir, filename))
-
-                # Perform column validations, row validations, Set key column
-                # If failure on any one of those operations, continue to next
-                rows, cols = table.getDimensions()
-
-                colsRemoved = table.validateColumns()
-                if cols - colsRemoved == 0:
-                    continue
-
-                keySet = table.setKey()
-                if not keySet:
-                    continue
-
-                table.write(output)
-
-                successes += 1
-                rowSizes.append(rows)
+    parser = argparse.ArgumentParser(description="Convert the files in input/ into tmp/output.txt.")
+    parser.add_argument("--workers", type=int, default=1, help="number of files converted at once")
+    parser.add_argument("--time-limit", type=float, default=None, help="seconds allowed to convert a single file")
+    parser.add_argument("--memory-limit", type=float, default=None, help="MB of memory (RSS) allowed to convert a single file")
+    parser.add_argument("--resume", action="store_true", help="continue an interrupted run from tmp/checkpoint.json")
+    parser.add_argument("--checkpoint-interval", type=float, default=CHECKPOINT_INTERVAL, help="seconds between checkpoints")
+    args = parser.parse_args()
+
+    filepath = os.path.dirname(os.path.realpath(__file__))
+    memoryLimit = args.memory_limit * 2 ** 20 if args.memory_limit else None
+    outputPath = os.path.join(filepath, 'tmp', 'output.txt')
+    quarantinePath = os.path.join(filepath, 'tmp', 'quarantine.txt')
+    checkpointPath = os.path.join(filepath, 'tmp', 'checkpoint.json')
+
+    dirStr = os.path.join(filepath, 'input') # Join abs. path of file with input/
+    paths = schedule(find_files(dirStr))
+
+    state = {
+        'schedule': schedule_hash(paths),
+        'next': 0,
+        'output': 0,
+        'quarantine': 0,
+        'tableCount': 0,
+        'successes': 0,
+        'quarantined': 0,
+        'rowSizes': [],
+        'colSizes': [],
+        'allColsRemoved': [],
+    }
+
+    checkpoint = load_checkpoint(checkpointPath) if args.resume else None
+    if checkpoint is not None and checkpoint['schedule'] == state['schedule']:
+        # Discard anything written after the checkpoint, it will be written again
+        state = checkpoint
+        os.truncate(outputPath, state['output'])
+        os.truncate(quarantinePath, state['quarantine'])
+        mode = 'a'
+        print("Resuming from file {0} of {1}".format(state['next'] + 1, len(paths)))
+    else:
+        if checkpoint is not None:
+            print("The files in input/ have changed since the checkpoint, starting over")
+        mode = 'w'
+
+    with open(outputPath, mode, encoding='utf8') as output, \
+            open(quarantinePath, mode, encoding='utf8') as quarantine:
+        lastCheckpoint = time.monotonic()
+
+        for path, result, reason in convert_all(paths[state['next']:], args.workers, args.time_limit, memoryLimit):
+            state['tableCount'] += 1
+            state['next'] += 1
+            if state['tableCount'] % 10 == 0:
+                sys.stderr.write('\r' + str(state['tableCount']) + " tables analyzed")
+                sys.stderr.flush()
+
+            if reason is not None:
+                quarantine.write("{0}\t{1}\n".format(path, reason))
+                state['quarantined'] += 1
+
+            elif result is not None:
+                text, rows, cols, colsRemoved = result
+                output.write(text)
+
+                state['successes'] += 1
+                state['rowSizes'].append(rows)
                 # allRowsRemoved.append(rowsRemoved)
-                colSizes.append(cols)
-                allColsRemoved.append(colsRemoved)
-
-        if len(rowSizes) > 0:
-            print("\n\nNumber of tables read: {0}".format(tableCount))
-            print(
-                "Number of tables successfully converted to txt: {0}".format(successes))
-            print("Successful conversion rate: {0:5.3}%".format(
-                successes / tableCount * 100))
-            print("Average number of rows per table: {0:5.3}".format(
-                avg(rowSizes)))
-            print("Average number of columns per table: {0:5.3}".format(
-                avg(colSizes)))
-            print("Average number of columns removed per table: {0:5.3}".format(
-                avg(allColsRemoved)))
+                state['colSizes'].append(cols)
+                state['allColsRemoved'].append(colsRemoved)
+
+            if time.monotonic() - lastCheckpoint > args.checkpoint_interval:
+                save_checkpoint(checkpointPath, state, output, quarantine)
+                lastCheckpoint = time.monotonic()
+
+        print_summary(state['tableCount'], state['successes'], state['rowSizes'], state['colSizes'], state['allColsRemoved'])
+        if state['quarantined'] > 0:
+            print("Number of files quarantined: {0} (see tmp/quarantine.txt)".format(state['quarantined']))
+
+    # The run is complete, so there is nothing left to resume
+    try:
+        os.remove(checkpointPath)
+    except FileNotFoundError:
+        pass
+
+    return
+
+
+def load_checkpoint(checkpointPath):
+    """
+    Reads the checkpoint written by 'save_checkpoint',
+    returning None if there is no checkpoint
+    """
+    try:
+        with open(checkpointPath, encoding='utf8') as inp:
+            return json.load(inp)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(checkpointPath, state, output, quarantine):
+    """
+    Records the progress of the run, so that an interrupted run can be resumed.
+    The output files are flushed to disk before the checkpoint is written, and
+    the checkpoint replaces the previous one atomically, so that the checkpoint never
+    refers to output which was not written, even if the process is killed part way.
+
+    Arguments:
+    - checkpointPath: The path of the checkpoint
+    - state: The progress of the run, i.e. the # of files of the schedule
+    processed and the statistics printed at the end of the run
+    - output: The open output.txt
+    - quarantine: The open quarantine.txt
+    """
+    for f in (output, quarantine):
+        f.flush()
+        os.fsync(f.fileno())
+    state['output'] = output.tell()
+    state['quarantine'] = quarantine.tell()
+
+    tmpPath = checkpointPath + '.tmp'
+    with open(tmpPath, 'w', encoding='utf8') as out:
+        json.dump(state, out)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(tmpPath, checkpointPath)
+    return
+
+
+def schedule_hash(paths):
+    """
+    A digest of the files and their order, used to check that a checkpoint
+    was made for the same schedule as the current run
+    """
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update("{0}\t{1}\n".format(path, os.path.getsize(path)).encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+def schedule(paths):
+    """
+    Orders the files largest-first, so that the longest conversions
+    start first and do not hold up the end of the run.
+    Files of equal size are ordered by path, so the order is deterministic.
+    """
+    return sorted(paths, key=lambda path: (-os.path.getsize(path), path))
+
+
+def convert_all(paths, workers=1, timeLimit=None, memoryLimit=None, convert=None):
+    """
+    Converts every file in 'paths', each in its own child process, with at most
+    'workers' conversions running at once. A conversion which runs for longer than
+    'timeLimit' seconds or whose resident memory exceeds 'memoryLimit' bytes is killed,
+    so that a single pathological file cannot stall or crash the whole run.
+    The memory limit is only enforced where /proc is available (i.e. Linux).
+    Without either limit no conversion is ever killed, so the files are converted
+    in this process, or in a pool of reused processes when 'workers' > 1.
+
+    Arguments:
+    - paths: The paths of the files to convert
+    - workers: The maximum number of conversions running at once
+    - timeLimit: The wall-clock budget of a single conversion, or None
+    - memoryLimit: The RSS budget of a single conversion, or None
+    - convert: The function converting a single file, which must be picklable,
+    or None for 'convert_file'
+
+    Returns:
+    - A generator of (path, result, reason) in the same order as 'paths', where
+    'result' is the result of 'convert' and 'reason' is None unless the
+    conversion failed, in which case it describes why.
+    """
+    paths = list(paths)
+    if timeLimit is None and memoryLimit is None:
+        if workers <= 1:
+            for path in paths:
+                yield try_convert(path, convert)
         else:
-            print("No tables successfully read.")
+            with multiprocessing.Pool(workers) as pool:
+                yield from pool.imap(partial(try_convert, convert=convert), paths)
+        return
+
+    running = { }
+    finished = { }
+    nextJob = 0
+    nextResult = 0
+
+    while nextResult < len(paths):
+        while nextJob < len(paths) and len(running) < max(workers, 1):
+            recv, send = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=convert_worker, args=(paths[nextJob], send, convert), daemon=True)
+            process.start()
+            send.close()
+            running[nextJob] = (process, recv, time.monotonic())
+            nextJob += 1
+
+        multiprocessing.connection.wait([recv for _, recv, _ in running.values()], timeout=0.1)
+
+        for i, (process, recv, start) in list(running.items()):
+            reason = None
+            result = None
+            if recv.poll():
+                try:
+                    _, result, reason = recv.recv()
+                except EOFError:
+                    process.join()
+                    reason = "exited with code {0}".format(process.exitcode)
+            elif timeLimit is not None and time.monotonic() - start > timeLimit:
+                reason = "exceeded time limit of {0}s".format(timeLimit)
+            elif memoryLimit is not None and rss(process.pid) > memoryLimit:
+                reason = "exceeded memory limit of {0:.0f}MB".format(memoryLimit / 2 ** 20)
+            else:
+                continue
+
+            process.kill()
+            process.join()
+            recv.close()
+            del running[i]
+            finished[i] = (paths[i], result, reason)
+
+        while nextResult in finished:
+            yield finished.pop(nextResult)
+            nextResult += 1
+
+
+def convert_worker(path, send, convert=None):
+    """
+    Converts a single file with 'convert' in a child process of 'convert_all',
+    sending the result back through 'send'
+    """
+    send.send(try_convert(path, convert))
+    send.close()
+
+
+def try_convert(path, convert=None):
+    """
+    Converts a single file with 'convert', or 'convert_file' if None, returning
+    (path, result, reason) as 'convert_all' rather than raising if it fails
+    """
+    try:
+        return path, (convert or convert_file)(path), None
+    except Exception as error:
+        return path, None, "{0}: {1}".format(type(error).__name__, error)
+
+
+def rss(pid):
+    """
+    The resident memory of a process in bytes, or 0 if it cannot be determined
+    """
+    try:
+        with open("/proc/{0}/statm".format(pid)) as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
 
+
+def find_files(dirStr):
+    """
+    Finds all of the .xlsx and .csv files in 'dirStr' and its subdirectories
+
+    Returns:
+    A generator of the paths to the files, in the order os.walk visits them
+    """
+    for subDir, _, files in os.walk(dirStr):
+        for file in files:
+            filename = os.fsdecode(file)
+            if not (filename.endswith(".xlsx") or filename.endswith(".csv")): 
+                continue
+            yield os.path.join(subDir, filename)
+
+
+def convert_file(path):
+    """
+    Converts a single .xlsx or .csv file to the text format read by makeDB.
+
+    Arguments:
+    - path: The path to the file
+
+    Returns:
+    - None if the table is not valid, otherwise the text of the table
+    along with its # of rows, # of columns and # of columns removed
+    """
+    table = converter.Converter(filepath=path)
+
+    # Perform column validations, row validations, Set key column
+    # If failure on any one of those operations, continue to next
+    rows, cols = table.getDimensions()
+
+    colsRemoved = table.validateColumns()
+    if cols - colsRemoved == 0:
+        return None
+
+    keySet = table.setKey()
+    if not keySet:
+        return None
+
+    text = io.StringIO()
+    table.write(text)
+
+    return text.getvalue(), rows, cols, colsRemoved
+
+
+def print_summary(tableCount, successes, rowSizes, colSizes, allColsRemoved):
+    """
+    Prints the statistics of the conversion
+    """
+    if len(rowSizes) > 0:
+        print("\n\nNumber of tables read: {0}".format(tableCount))
+        print(
+            "Number of tables successfully converted to txt: {0}".format(successes))
+        print("Successful conversion rate: {0:5.3}%".format(
+            successes / tableCount * 100))
+        print("Average number of rows per table: {0:5.3}".format(
+            avg(rowSizes)))
+        print("Average number of columns per table: {0:5.3}".format(
+            avg(colSizes)))
+        print("Average number of columns removed per table: {0:5.3}".format(
+            avg(allColsRemoved)))
+    else:
+        print("No tables successfully read.")
     return
 
 
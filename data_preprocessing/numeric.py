@@ -0,0 +1,121 @@
+import math
+
+"""
+Postings of the values in numerical columns. Every numerical cell is parsed
+once when the database is built, so that the columns containing a given set of
+numbers can be found through range scans on an index, rather than by
+aggregating every numerical column in the database.
+
+Our schema is as follows:
+
+numeric_values(value, table_id, col_id, rounded)
+"""
+
+DIGITS = 3
+
+
+def build_numeric_index(conn, digits=DIGITS):
+    """
+    Builds the 'numeric_values' table from the cells of every column
+    labelled 'numerical' in the 'columns' table. Any previous index is replaced.
+
+    Arguments:
+    conn: The connection to the database
+    digits: The number of significant digits kept in the 'rounded' key
+    """
+    c = conn.cursor()
+
+    c.execute("DROP TABLE IF EXISTS numeric_values;")
+    c.execute("""CREATE TABLE numeric_values(value real, table_id integer, col_id integer, rounded real,
+                PRIMARY KEY (value, table_id, col_id)) WITHOUT ROWID;""")
+
+    values = set()
+    cells = c.execute("""SELECT table_id, col_id, value
+                        FROM cells NATURAL JOIN columns
+                        WHERE type = 'numerical'
+                        AND location = 'cell'
+                        AND value != '';""").fetchall()
+    for table_id, col_id, value in cells:
+        value = parse_number(value)
+        if value is not None:
+            values.add((value, table_id, col_id, round_sig(value, digits)))
+
+    c.executemany("INSERT INTO numeric_values VALUES (?, ?, ?, ?);", values)
+    print("Inserted into numeric_values")
+    c.execute("CREATE INDEX idx_nv_rounded ON numeric_values(rounded);")
+
+    return
+
+
+def overlapping_columns(conn, values, tolerance=0, rounded=False, digits=DIGITS, min_overlap=0):
+    """
+    Finds the numerical columns which contain the numbers in 'values'. The overlap
+    of a column is computed in the same way as 'overlapSim' on the server: the
+    fraction of the entries of 'values' which appear in the column.
+
+    Arguments:
+    conn: The connection to the database
+    values: The numbers of the (seed set) column
+    tolerance: Two numbers match if they differ by at most this amount
+    rounded: If True, two numbers instead match if they are equal when rounded
+        to 'digits' significant digits (must match the digits used to build the index)
+    digits: The number of significant digits used for rounding
+    min_overlap: The minimum overlap of a returned column
+
+    Returns:
+    A list of (table_id, col_id, overlap) tuples in descending order of overlap
+    """
+    counts = { }
+    for value in values:
+        value = parse_number(value)
+        if value is not None:
+            counts[value] = counts.get(value, 0) + 1
+
+    total = sum(counts.values())
+    if total == 0:
+        return []
+
+    if rounded:
+        seed = ", ".join("(?, ?, ?)" for _ in counts)
+        seedParams = [p for v, n in counts.items() for p in (v, n, round_sig(v, digits))]
+        join = "n.rounded = s.r"
+        joinParams = []
+    else:
+        seed = ", ".join("(?, ?, NULL)" for _ in counts)
+        seedParams = [p for item in counts.items() for p in item]
+        join = "n.value BETWEEN s.v - ? AND s.v + ?"
+        joinParams = [tolerance, tolerance]
+
+    return conn.execute(f"""
+                WITH seed(v, n, r) AS (VALUES {seed})
+                SELECT table_id, col_id, SUM(n) * 1.0 / ? AS overlap
+                FROM (
+                    SELECT DISTINCT n.table_id, n.col_id, s.v, s.n
+                    FROM seed s JOIN numeric_values n
+                    ON {join}
+                )
+                GROUP BY table_id, col_id
+                HAVING overlap >= ?
+                ORDER BY overlap DESC, table_id, col_id;
+            """, [*seedParams, total, *joinParams, min_overlap]).fetchall()
+
+
+def parse_number(value):
+    """
+    Parses a cell into a float, returning None if the cell is not a finite number
+    """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if math.isfinite(value) else None
+
+
+def round_sig(value, digits=DIGITS):
+    """
+    Rounds 'value' to 'digits' significant digits, so that numbers of any
+    magnitude can be matched within a relative tolerance.
+    """
+    if value == 0:
+        return 0.0
+    return round(value, digits - 1 - math.floor(math.log10(abs(value))))
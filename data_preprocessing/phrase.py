@@ -0,0 +1,96 @@
+import re
+from makeDB import fixValue
+
+"""
+Phrase queries over the positional index built by makeDB.py --positions.
+The keyword tables only record that a word appears somewhere in a cell or
+title, so a query such as "new york" matches every cell containing both
+"new" and "york". The positional tables also record the offset of each word,
+and so the cells (or titles and captions) containing the words of a phrase
+consecutively can be found with one index lookup per word.
+
+Our schema is as follows:
+
+positions_cell_header(keyword, table_id, row_id, col_id, position, location)
+positions_title_caption(keyword, table_id, location, position)
+"""
+
+
+def phrase_cells(conn, phrase):
+    """
+    Finds the cells and headers which contain 'phrase'
+
+    Arguments:
+    conn: The connection to the database
+    phrase: The phrase to search for, i.e. "new york"
+
+    Returns:
+    A sorted list of distinct (table_id, row_id, col_id, location) tuples
+    """
+    words = tokenize(phrase)
+    if len(words) == 0:
+        return []
+
+    stmt = phrase_sql("positions_cell_header", ["table_id", "row_id", "col_id"], len(words))
+    return conn.execute(f"""
+                SELECT DISTINCT p0.table_id, p0.row_id, p0.col_id, p0.location
+                {stmt}
+                ORDER BY p0.table_id, p0.row_id, p0.col_id;
+            """, words).fetchall()
+
+
+def phrase_titles(conn, phrase):
+    """
+    Finds the titles and captions which contain 'phrase'
+
+    Arguments:
+    conn: The connection to the database
+    phrase: The phrase to search for
+
+    Returns:
+    A sorted list of distinct (table_id, location) tuples
+    """
+    words = tokenize(phrase)
+    if len(words) == 0:
+        return []
+
+    stmt = phrase_sql("positions_title_caption", ["table_id", "location"], len(words))
+    return conn.execute(f"""
+                SELECT DISTINCT p0.table_id, p0.location
+                {stmt}
+                ORDER BY p0.table_id, p0.location;
+            """, words).fetchall()
+
+
+def phrase_sql(table, keys, n):
+    """
+    Builds the FROM and WHERE clauses which match 'n' consecutive words,
+    by joining the positions of the i'th word (p{i}) to those of the first (p0).
+    Each join is a lookup on the primary key of 'table'.
+
+    Arguments:
+    table: The positional table to search
+    keys: The columns which identify the cell, title or caption of a word
+    n: The number of words in the phrase
+
+    Returns:
+    The clauses, where the i'th word is bound to parameter ?{i + 1}
+    """
+    joins = ""
+    for i in range(1, n):
+        same = "".join(f" AND p{i}.{key} = p0.{key}" for key in keys)
+        joins += f"""
+                JOIN {table} p{i}
+                ON p{i}.keyword = ?{i + 1}{same}
+                AND p{i}.position = p0.position + {i}"""
+
+    return f"""FROM {table} p0{joins}
+                WHERE p0.keyword = ?1"""
+
+
+def tokenize(phrase):
+    """
+    Splits a phrase into words in the same way as 'makeDB.handle_cell_keywords'
+    """
+    words = (fixValue(word) for word in re.split(r'[ _]+', phrase.lower().strip(',.')))
+    return [word for word in words if len(word) > 0]
@@ -0,0 +1,202 @@
+import sqlite3
+import argparse
+import os
+import queue
+import sys
+import tempfile
+import threading
+from functools import partial
+from pathlib import Path
+import makeText
+import makeDB
+
+"""
+This program converts the .csv and .xlsx files in input/ straight into the
+SQLite3 database, fusing makeText.py and makeDB.py into a single pass.
+
+Worker processes convert the files with the Converter class, as makeText does (with
+the same time and memory budgets, quarantining the files which fail in
+tmp/quarantine.txt), parse the text of each table with makeDB in the same process,
+and hand the parsed tables to a bounded queue rather than writing tmp/output.txt.
+A dedicated writer thread only numbers and inserts the tables in batches while the
+conversion continues, so the CPU-bound conversion and parsing overlap with the
+I/O-bound insertion. Tables are numbered in the same (largest-first) order as
+makeText, and so the database is identical to running makeText.py followed by makeDB.py.
+If the conversion is interrupted, the database is left without its indices and
+without 'complete' in 'build_info'.
+"""
+
+
+def main():
+    filepath = os.path.dirname(os.path.realpath(__file__)) # Get location of current file
+    db_name = os.path.join(Path(filepath).parent, 'program', 'server', 'data', 'database.db')
+
+    parser = argparse.ArgumentParser(description="Convert input/ directly into database.db.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of conversion processes")
+    parser.add_argument("--queue-size", type=int, default=64, help="maximum number of files waiting to be inserted")
+    parser.add_argument("--batch-size", type=int, default=100, help="number of tables inserted per transaction")
+    parser.add_argument("--time-limit", type=float, default=None, help="seconds allowed to convert a single file")
+    parser.add_argument("--memory-limit", type=float, default=None, help="MB of memory (RSS) allowed to convert a single file")
+    parser.add_argument("--positions", action="store_true", help="also build the positional index used for phrase queries")
+    args = parser.parse_args()
+
+    memoryLimit = args.memory_limit * 2 ** 20 if args.memory_limit else None
+    run(os.path.join(filepath, 'input'), db_name, args.workers, args.queue_size, args.batch_size, args.positions,
+        args.time_limit, memoryLimit, os.path.join(filepath, 'tmp', 'quarantine.txt'))
+    return
+
+
+def run(dirStr, db_name, workers=None, queueSize=64, batchSize=100, positions=False,
+        timeLimit=None, memoryLimit=None, quarantinePath=os.devnull):
+    """
+    Converts every file in 'dirStr' into the database at 'db_name'
+
+    Arguments:
+    dirStr: The directory containing the .csv and .xlsx files
+    db_name: The path of the database, which is replaced if it exists
+    workers: The number of conversion processes
+    queueSize: The maximum number of files converted but not yet inserted
+    batchSize: The number of tables inserted per transaction
+    positions: Whether to build the positional index
+    timeLimit: The wall-clock budget of converting a single file in seconds, or None
+    memoryLimit: The RSS budget of converting a single file in bytes, or None
+    quarantinePath: The file in which the files which failed to convert are recorded
+    """
+    try:
+        os.remove(db_name)
+    except FileNotFoundError:
+        pass
+
+    records = queue.Queue(maxsize=queueSize)
+    writer = Writer(db_name, records, batchSize, positions)
+    writer.start()
+
+    rowSizes = []
+    colSizes = []
+    allColsRemoved = []
+    tableCount = 0
+    quarantined = 0
+
+    completed = False
+    try:
+        with open(quarantinePath, 'w', encoding='utf8') as quarantine:
+            # Results arrive in schedule order, so that table numbers are deterministic
+            paths = makeText.schedule(makeText.find_files(dirStr))
+            convert = partial(convert_file, positions=positions)
+            for path, result, reason in makeText.convert_all(paths, workers or os.cpu_count(), timeLimit, memoryLimit, convert):
+                tableCount += 1
+                if reason is not None:
+                    quarantine.write("{0}\t{1}\n".format(path, reason))
+                    quarantined += 1
+                elif result is not None:
+                    tables, rows, cols, colsRemoved = result
+                    records.put(tables) # Blocks while the writer is behind
+                    rowSizes.append(rows)
+                    colSizes.append(cols)
+                    allColsRemoved.append(colsRemoved)
+        completed = True
+    finally:
+        # The writer only builds the indices once every file has been converted
+        records.put(None if completed else Writer.ABORT)
+        writer.join()
+
+    if writer.error is not None:
+        raise writer.error
+
+    makeText.print_summary(tableCount, len(rowSizes), rowSizes, colSizes, allColsRemoved)
+    if quarantined > 0:
+        print("Number of files quarantined: {0} (see tmp/quarantine.txt)".format(quarantined))
+    print("Finished creating database")
+    return
+
+
+def convert_file(path, positions=False):
+    """
+    Converts a single file with makeText and parses its tables with makeDB, in a
+    worker process. The tables are numbered by the writer, so they are parsed as table 0.
+
+    Arguments:
+    path: The path of the file
+    positions: Whether to parse the positional index
+
+    Returns:
+    The parsed tables and the statistics of makeText.convert_file, or None if the file is skipped
+    """
+    result = makeText.convert_file(path)
+    if result is None:
+        return None
+
+    text, rows, cols, colsRemoved = result
+    tables = [makeDB.parse_table(lines, 0, positions) for lines in makeDB.read_tables(text.splitlines(keepends=True))]
+    return tables, rows, cols, colsRemoved
+
+
+class Writer(threading.Thread):
+    """
+    An instance of this class is the thread which owns the database connection,
+    numbering the parsed tables of each file from the queue and inserting them in batches.
+    As in makeDB, the keyword rows are spilled to sorted runs and inserted in
+    primary-key order once every table is inserted.
+    A None in the queue signals that all files have been converted, and ABORT that
+    the conversion failed, in which case the database is not finalized.
+    """
+
+    ABORT = "abort"
+
+    def __init__(self, db_name, records, batchSize, positions=False):
+        super().__init__(daemon=True)
+        self.db_name = db_name
+        self.records = records
+        self.batchSize = batchSize
+        self.positions = positions
+        self.error = None
+
+    def run(self):
+        conn = sqlite3.connect(self.db_name)
+        c = conn.cursor()
+        runDir = tempfile.TemporaryDirectory()
+        runs = makeDB.SortedRuns(runDir.name)
+        tables = []
+        table_num = 0
+        parsed = []
+
+        try:
+            makeDB.create_tables(c, self.positions)
+
+            parsed = self.records.get()
+            while parsed is not None and parsed is not Writer.ABORT:
+                # Tables are numbered in the order the files were scheduled
+                for table in parsed:
+                    table_num += 1
+                    tables.append(makeDB.renumber_table(table, table_num))
+
+                if len(tables) >= self.batchSize:
+                    makeDB.insert_tables(c, tables, positions=self.positions, runs=runs, batch=table_num)
+                    conn.commit()
+                    tables = []
+                    sys.stderr.write('\r{0} tables added into the database'.format(table_num))
+                    sys.stderr.flush()
+
+                parsed = self.records.get()
+
+            if parsed is Writer.ABORT:
+                return
+
+            makeDB.insert_tables(c, tables, positions=self.positions, runs=runs, batch=table_num)
+            print("\n{0} tables added into the database".format(table_num))
+            runs.merge(c, self.positions)
+            makeDB.build_indices(conn)
+            makeDB.set_build_info(c, complete=1)
+            conn.commit()
+        except Exception as error:
+            self.error = error
+            # Keep draining the queue so that the producer is never blocked
+            while parsed is not None and parsed is not Writer.ABORT:
+                parsed = self.records.get()
+        finally:
+            conn.close()
+            runDir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import re
+
+"""
+Character q-gram (trigram) index over the textual cells of the database.
+Every textual cell is normalized, and each distinct normalized value is
+split into padded trigrams. The postings allow values that are similar to
+a query (misspellings, small differences in punctuation or spacing) to be
+found through index lookups, rather than computing the Levenshtein distance
+against every value in the database.
+
+Our schema is as follows:
+
+text_values(value_id, value, num_grams)
+value_trigrams(gram, value_id)
+text_value_cells(value_id, table_id, row_id, col_id)
+"""
+
+Q = 3
+whitespace = re.compile(r"\s+")
+
+
+def build_trigram_index(conn):
+    """
+    Builds the trigram index from the 'cells' and 'columns' tables
+    of an existing database. Any previous index is replaced.
+
+    Arguments:
+    conn: The connection to the database
+    """
+    c = conn.cursor()
+
+    c.execute("DROP TABLE IF EXISTS text_values;")
+    c.execute("DROP TABLE IF EXISTS value_trigrams;")
+    c.execute("DROP TABLE IF EXISTS text_value_cells;")
+
+    c.execute("""CREATE TABLE text_values(value_id integer, value text, num_grams integer,
+                PRIMARY KEY (value_id));""")
+    c.execute("""CREATE TABLE value_trigrams(gram varchar, value_id integer,
+                PRIMARY KEY (gram, value_id)) WITHOUT ROWID;""")
+    c.execute("""CREATE TABLE text_value_cells(value_id integer, table_id integer, row_id integer, col_id integer,
+                PRIMARY KEY (value_id, table_id, row_id, col_id)) WITHOUT ROWID;""")
+
+    values = { }
+    valueCells = []
+
+    cells = c.execute("""SELECT table_id, row_id, col_id, value
+                        FROM cells NATURAL JOIN columns
+                        WHERE type = 'text'
+                        AND location = 'cell'
+                        AND value != '';""").fetchall()
+    for table_id, row_id, col_id, value in cells:
+        value = normalize_value(value)
+        if len(value) == 0:
+            continue
+        value_id = values.setdefault(value, len(values))
+        valueCells.append((value_id, table_id, row_id, col_id))
+
+    textValues = []
+    trigrams = []
+    for value, value_id in values.items():
+        grams = qgrams(value)
+        textValues.append((value_id, value, len(grams)))
+        trigrams.extend((gram, value_id) for gram in grams)
+
+    c.executemany("INSERT INTO text_values VALUES (?, ?, ?);", textValues)
+    print("Inserted into text_values")
+    c.executemany("INSERT INTO value_trigrams VALUES (?, ?);", trigrams)
+    print("Inserted into value_trigrams")
+    c.executemany("INSERT INTO text_value_cells VALUES (?, ?, ?, ?);", valueCells)
+    print("Inserted into text_value_cells")
+
+    return
+
+
+def similar_values(conn, value, k=10, min_similarity=0.5):
+    """
+    Retrieves the 'k' values in the index most similar to 'value'.
+    Candidates are found through count filtering: a value within
+    Levenshtein distance d of the query must share at least
+    max(|G(query)|, |G(value)|) - q * d of its distinct q-grams with the query.
+    When |G(query)| - q * d <= 0, i.e. at low similarities, the filter cannot
+    prune and the values are only filtered by their length.
+    The remaining candidates are verified with the normalized Levenshtein
+    similarity used when ranking rows on the server.
+
+    Arguments:
+    conn: The connection to the database
+    value: The (un-normalized) value to search for
+    k: The maximum number of values returned
+    min_similarity: The lowest similarity, between 0 and 1, of a returned value
+
+    Returns:
+    A list of (value_id, value, similarity) tuples in descending order of similarity
+    """
+    value = normalize_value(value)
+    if len(value) == 0:
+        return []
+
+    grams = qgrams(value)
+    min_similarity = max(min_similarity, 1e-5)
+    # The tolerance keeps values exactly at 'min_similarity' despite rounding
+    maxDist = int((1 - min_similarity) * len(value) / min_similarity + 1e-9)
+
+    if len(grams) <= Q * maxDist:
+        # The count filter cannot prune, as a value sharing no q-gram with the
+        # query may be similar enough, so every value of a similar length is verified
+        candidates = conn.execute("""
+                SELECT value_id, value
+                FROM text_values
+                WHERE ABS(LENGTH(value) - ?) <= ?;
+            """, (len(value), maxDist)).fetchall()
+    else:
+        qMarks = ", ".join("?" for _ in grams)
+        candidates = conn.execute(f"""
+                SELECT value_id, value
+                FROM value_trigrams NATURAL JOIN text_values
+                WHERE gram IN ({qMarks})
+                AND ABS(LENGTH(value) - ?) <= ?
+                GROUP BY value_id
+                HAVING COUNT(*) >= MAX(?, num_grams) - ?;
+            """, [*grams, len(value), maxDist, len(grams), Q * maxDist]).fetchall()
+
+    results = []
+    for value_id, candidate in candidates:
+        sim = 1 - levenshtein(value, candidate) / max(len(value), len(candidate))
+        if sim >= min_similarity:
+            results.append((value_id, candidate, sim))
+
+    results.sort(key=lambda res: (-res[2], res[1]))
+    return results[:k]
+
+
+def matching_cells(conn, value_ids):
+    """
+    Gets the cells containing the values found by 'similar_values'
+
+    Arguments:
+    conn: The connection to the database
+    value_ids: The ids of the values
+
+    Returns:
+    A list of (value_id, table_id, row_id, col_id) tuples
+    """
+    value_ids = list(value_ids)
+    if len(value_ids) == 0:
+        return []
+    qMarks = ", ".join("?" for _ in value_ids)
+    return conn.execute(f"""
+                SELECT value_id, table_id, row_id, col_id
+                FROM text_value_cells
+                WHERE value_id IN ({qMarks});
+            """, value_ids).fetchall()
+
+
+def normalize_value(value):
+    """
+    Normalizes a cell value so that values differing only
+    in case or whitespace are treated as equal.
+    """
+    return whitespace.sub(" ", value).strip().lower()
+
+
+def qgrams(value, q=Q):
+    """
+    Splits a normalized value into its set of distinct q-grams. The value is
+    padded with q - 1 sentinel characters on either side so that its
+    prefix and suffix are represented.
+    """
+    padded = "\x02" * (q - 1) + value + "\x03" * (q - 1)
+    return {padded[i: i + q] for i in range(len(padded) - q + 1)}
+
+
+def levenshtein(a, b):
+    """
+    Computes the Levenshtein (edit) distance between two strings
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        prev = cur
+    return prev[-1]
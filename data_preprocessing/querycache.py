@@ -0,0 +1,225 @@
+import sqlite3
+import argparse
+import collections
+import json
+import os
+import re
+import sys
+import time
+from multiprocessing import Pool
+from pathlib import Path
+from queryplan import keyword_search_sql
+
+"""
+Precomputes the results of the most frequent keyword searches from a query log.
+Each line of the log is one search, as typed into the search bar, i.e.
+
+country, population
+
+The keyword search SQL of the server (Database.keywordSearch) is run for each
+distinct query in parallel read-only connections, and every row it returns is
+stored in the 'query_cache' table of the database, in the same order. The server
+answers a query found in the cache with a single indexed read, and the client
+ranks the rows exactly as it ranks those of a live search. As on the server
+(Database.all), empty cells are returned as 'NULL'.
+
+Our schema is as follows:
+
+query_cache(query, results, num_tables, hits, last_logged, build_version)
+
+'query' is the JSON array of the distinct keywords in sorted order, so that the
+same keywords in any order share an entry. 'hits' is the number of times the
+query appears in the query log, and 'last_logged' is the time of the last build
+whose log contained it; they decide which entries are evicted when the cache is
+full. The server opens the database read-only, and so it does not record its own
+hits; the query log is the only source of frequencies. 'build_version' is the 'version' in 'build_info' when the
+entry was computed; makeDB stamps a new version whenever it rebuilds the database,
+so entries from an earlier build are never served.
+"""
+
+TOP_QUERIES = 1000
+
+
+def main():
+    filepath = os.path.dirname(os.path.realpath(__file__))
+    db_name = os.path.join(Path(filepath).parent, 'program', 'server', 'data', 'database.db')
+
+    parser = argparse.ArgumentParser(description="Cache the results of the most frequent keyword searches.")
+    parser.add_argument("log", help="query log, with one comma separated list of keywords per line")
+    parser.add_argument("--db", default=db_name, help="path to database.db")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--top", type=int, default=TOP_QUERIES, help="maximum number of queries kept in the cache")
+    args = parser.parse_args()
+
+    with open(args.log, encoding='utf8') as inp:
+        counts = read_log(inp)
+    print("{0} distinct queries in the log".format(len(counts)))
+
+    build_cache(args.db, counts, args.top, args.workers)
+    print("Finished building the query cache")
+    return
+
+
+def read_log(lines):
+    """
+    Counts the occurrences of each query in a query log
+
+    Arguments:
+    lines: An iterable of the lines of the log
+
+    Returns:
+    A Counter of the number of occurrences of each query key
+    """
+    counts = collections.Counter()
+    for line in lines:
+        keywords = parse_query(line)
+        if len(keywords) > 0:
+            counts[query_key(keywords)] += 1
+    return counts
+
+
+def parse_query(line):
+    """
+    Splits a query into its keywords in the same way as the client, which lowercases
+    the search before passing it to ResultService.getKeywords (SeedSet.vue)
+    """
+    line = line.strip('\r\n').lower()
+    if len(line.strip()) == 0:
+        return []
+    return re.split(r' *, *', line)
+
+
+def query_key(keywords):
+    """
+    Returns the key of the query for 'keywords', matching Database.queryKey in db.js
+    """
+    return json.dumps(sorted(set(keywords)), ensure_ascii=False, separators=(',', ':'))
+
+
+def build_cache(db_name, counts, top=TOP_QUERIES, workers=None):
+    """
+    Computes the results of the 'top' most frequent queries and stores them in the
+    'query_cache' table. Entries from an earlier build of the database are removed,
+    and then the least frequent entries are evicted until at most 'top' remain.
+
+    Arguments:
+    db_name: The path to the database
+    counts: A Counter of the number of occurrences of each query key, from 'read_log'
+    top: The maximum number of queries kept in the cache
+    workers: The number of worker processes
+    """
+    conn = sqlite3.connect(db_name)
+    c = conn.cursor()
+    version = get_version(c)
+
+    c.execute("""CREATE TABLE IF NOT EXISTS query_cache(query varchar, results varchar,
+                num_tables integer, hits integer, last_logged real, build_version varchar,
+                PRIMARY KEY (query));""")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_qc_hits ON query_cache(hits, last_logged);")
+    c.execute("DELETE FROM query_cache WHERE build_version IS NOT ?;", (version,))
+    conn.commit()
+
+    queries = [key for key, _ in counts.most_common(top)]
+
+    # The searches only read, so they run in parallel while 'conn' is idle
+    if workers is not None and workers <= 1:
+        init_worker(db_name)
+        results = [search_worker(key) for key in queries]
+    else:
+        with Pool(workers, initializer=init_worker, initargs=(db_name,)) as pool:
+            results = []
+            for i, result in enumerate(pool.imap(search_worker, queries, chunksize=8)):
+                results.append(result)
+                if (i + 1) % 100 == 0:
+                    sys.stderr.write('\r{0} queries searched'.format(i + 1))
+                    sys.stderr.flush()
+
+    now = time.time()
+    c.executemany("""INSERT INTO query_cache VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (query) DO UPDATE SET
+                    results = excluded.results,
+                    num_tables = excluded.num_tables,
+                    hits = MAX(hits, excluded.hits),
+                    last_logged = excluded.last_logged;""",
+                  ((key, json.dumps(rows), tables, counts[key], now, version)
+                   for key, (rows, tables) in zip(queries, results)))
+    print("\nInserted into query_cache")
+
+    evict(c, top)
+    conn.commit()
+    conn.close()
+    return
+
+
+connection = None
+
+
+def init_worker(db_name):
+    global connection
+    connection = sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+
+
+def search_worker(key):
+    return search(connection, json.loads(key))
+
+
+def search(conn, keywords):
+    """
+    Runs the keyword search of the server
+
+    Arguments:
+    conn: The connection to the database
+    keywords: The list of keywords
+
+    Returns:
+    The rows, as returned by the server, and the number of tables they belong to
+    """
+    conn.row_factory = sqlite3.Row
+    rows = [dict(row) for row in conn.execute(keyword_search_sql(keywords), [*keywords, *keywords])]
+    conn.row_factory = None
+
+    # Every row is stored exactly as the server returns it, so that the client
+    # ranks a cached result over the same tables as a live one
+    for row in rows:
+        row["value"] = null_cells(row["value"])
+
+    return rows, len({row["table_id"] for row in rows})
+
+
+def null_cells(value):
+    """
+    Replaces the empty cells of a row with 'NULL', as Database.all
+    """
+    if value is None:
+        return value
+    return " || ".join(cell if len(cell) > 0 else "NULL" for cell in value.split(" || "))
+
+
+def get_version(c):
+    """
+    Returns the build version stamped by makeDB, or None for a database built before versions
+    """
+    try:
+        row = c.execute("SELECT value FROM build_info WHERE key = 'version';").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row is not None else None
+
+
+def evict(c, capacity):
+    """
+    Deletes the entries least frequent in the query logs (those logged longest
+    ago first, among entries with as many hits) until at most 'capacity' entries remain
+    """
+    c.execute("""DELETE FROM query_cache
+                WHERE query NOT IN (
+                    SELECT query
+                    FROM query_cache
+                    ORDER BY hits DESC, last_logged DESC
+                    LIMIT ?
+                );""", (capacity,))
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+import sqlite3
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+import numpy as np
+from expand import register_functions
+from numeric import parse_number
+
+"""
+Query plan and latency regression harness for the SQL run by the server
+(program/server/data/db.js). A change to the schema or indices built by makeDB
+can silently turn one of the server's queries into a full scan, so this program
+runs a catalog of the server's statements against a built database.db, with
+parameters drawn from the database itself, and records for each statement:
+
+- The output of EXPLAIN QUERY PLAN
+- The 50th, 95th and 99th percentile latencies
+
+The results are compared with a baseline saved by a previous run (--update).
+The program exits with a non-zero status if a statement scans a table which it
+did not scan in the baseline, or if its 95th percentile latency exceeds the
+baseline by more than the allowed tolerance. A baseline saved with another
+version of SQLite is not compared, since its query planner may choose other
+plans for the same schema, and so the baseline must be saved again.
+"""
+
+TOLERANCE = 2.0
+SLACK = 1.0 # ms, so that very fast statements do not fail on noise
+RUNS = 20
+
+
+def main():
+    filepath = os.path.dirname(os.path.realpath(__file__))
+    db_name = os.path.join(Path(filepath).parent, 'program', 'server', 'data', 'database.db')
+
+    parser = argparse.ArgumentParser(description="Check the query plans and latencies of the server's SQL.")
+    parser.add_argument("--db", default=db_name, help="path to database.db")
+    parser.add_argument("--baseline", default=os.path.join(filepath, 'tmp', 'queryplan.json'), help="path to the baseline")
+    parser.add_argument("--runs", type=int, default=RUNS, help="number of timed executions of each statement")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed ratio of p95 latency to the baseline")
+    parser.add_argument("--update", action="store_true", help="save the results as the new baseline")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+    register_functions(conn)
+
+    results = run_catalog(conn, sample_parameters(conn), args.runs)
+    print_results(results)
+
+    if args.update:
+        with open(args.baseline, 'w', encoding='utf8') as out:
+            json.dump({'sqlite_version': sqlite3.sqlite_version, 'statements': results}, out, indent=2)
+        print("Saved baseline to {0}".format(args.baseline))
+        return
+
+    try:
+        with open(args.baseline, encoding='utf8') as inp:
+            baseline = json.load(inp)
+    except FileNotFoundError:
+        print("No baseline found at {0}, run with --update to create one".format(args.baseline))
+        return
+
+    if baseline.get('sqlite_version') != sqlite3.sqlite_version:
+        print("The baseline was saved with SQLite {0}, but this is SQLite {1}. The plans are not comparable, "
+              "run with --update to save a new baseline".format(baseline.get('sqlite_version', "(unknown)"),
+                                                               sqlite3.sqlite_version))
+        sys.exit(1)
+
+    failures = compare(results, baseline['statements'], args.tolerance)
+    for failure in failures:
+        print("FAIL " + failure)
+    if failures:
+        sys.exit(1)
+    print("All statements match the baseline")
+    return
+
+
+def sample_parameters(conn):
+    """
+    Chooses representative parameters for the statements from the database:
+    the most common keywords, and a seed set of two rows from the first table
+    with both a textual and a numerical column. The choice is deterministic,
+    so that repeated runs against the same database are comparable.
+
+    Returns:
+    A dictionary of the parameters used by 'catalog'
+    """
+    keywords = [row[0] for row in conn.execute("""SELECT keyword
+                                                FROM keywords_cell_header
+                                                WHERE LENGTH(keyword) > 2
+                                                GROUP BY keyword
+                                                ORDER BY COUNT(*) DESC, keyword
+                                                LIMIT 2;""")]
+
+    row = conn.execute("""SELECT table_id
+                        FROM columns
+                        GROUP BY table_id
+                        ORDER BY SUM(type = 'text') > 0 AND SUM(type = 'numerical') > 0 DESC, table_id
+                        LIMIT 1;""").fetchone()
+    table_id = row[0] if row is not None else 0
+
+    rowIDs = [row[0] for row in conn.execute("""SELECT DISTINCT row_id
+                                            FROM cells
+                                            WHERE table_id = ?
+                                            AND location = 'cell'
+                                            ORDER BY row_id
+                                            LIMIT 2;""", (table_id,))]
+
+    # The first textual and numerical columns of the seed set, as in Database.getMatchingTables
+    types = dict(conn.execute("SELECT col_id, type FROM columns WHERE table_id = ?;", (table_id,)))
+    textColID = min((c for c, t in types.items() if t == 'text'), default=None)
+    numColID = min((c for c, t in types.items() if t == 'numerical'), default=None)
+    textCol = []
+    numCol = []
+    for col_id, value in conn.execute(f"""SELECT col_id, value
+                                        FROM cells
+                                        WHERE table_id = ?
+                                        AND row_id IN {qmarks(rowIDs)}
+                                        AND value != ''
+                                        ORDER BY row_id, col_id;""", (table_id, *rowIDs)):
+        if col_id == textColID:
+            textCol.append(value)
+        elif col_id == numColID:
+            numCol.append(parse_number(value))
+
+    return {
+        'keywords': keywords or ["the"],
+        'table_id': table_id,
+        'rowIDs': rowIDs or [0],
+        'numCols': len(types),
+        'numTextual': max(1, sum(t == 'text' for t in types.values())),
+        'numNumerical': max(1, sum(t == 'numerical' for t in types.values())),
+        'textCol': textCol or [""],
+        'numCol': json.dumps(numCol),
+        'slider': 0.5,
+    }
+
+
+def qmarks(arr):
+    """
+    Returns "(?, ?, ..., ?)" with one '?' per entry of 'arr', as Database.getQMarks
+    """
+    return "({0})".format(", ".join("?" for _ in arr))
+
+
+def keyword_search_sql(keywords):
+    """
+    Returns the statement of Database.keywordSearch for 'keywords', which
+    takes the keywords twice as its parameters
+    """
+    keywordQMarks = qmarks(keywords)
+    return f"""
+            WITH cellHeaderRows(table_id, row_id) AS (
+                SELECT DISTINCT table_id, row_id
+                FROM keywords_cell_header
+                WHERE keyword IN {keywordQMarks}
+            ), titleCaptionRows(table_id) AS (
+                SELECT DISTINCT table_id
+                FROM keywords_title_caption
+                WHERE keyword IN {keywordQMarks}
+            ), keywordRows AS (
+                SELECT k.table_id, c.row_id, GROUP_CONCAT(c.value, ' || ') AS value
+                FROM cellHeaderRows k NATURAL JOIN cells c
+                WHERE c.location != 'header'
+                GROUP BY k.table_id, c.row_id
+
+                UNION
+
+                SELECT k.table_id,  c.row_id, GROUP_CONCAT(c.value, ' || ') AS value
+                FROM titleCaptionRows k NATURAL JOIN cells c
+                GROUP BY k.table_id, c.row_id
+
+                ORDER BY k.table_id, c.row_id
+            ), rowCounts(table_id, rowCount) AS (
+                SELECT table_id, COUNT(DISTINCT row_id) AS rowCount
+                FROM cells
+                GROUP BY table_id
+            ), rows(table_id, row_id, value, rowCount) AS (
+                SELECT r.table_id, row_id, value, rowCount
+                FROM keywordRows r
+                LEFT JOIN
+                rowCounts c
+                ON r.table_id = c.table_id
+            )
+            SELECT r.table_id, title, row_id, value, rowCount
+            FROM rows r NATURAL JOIN titles t;
+        """
+
+
+def catalog(p):
+    """
+    The statements of the server, with the parameters in 'p' from 'sample_parameters'.
+    Each statement is copied from the method of Database in db.js that it is named after.
+
+    Returns:
+    A list of (name, sql, params)
+    """
+    customTable = " UNION ALL ".join(f"SELECT {p['table_id']} AS table_id, {row_id} AS row_id" for row_id in p['rowIDs'])
+
+    matchingText = f"""
+                        SELECT table_id, title
+                        FROM cells NATURAL JOIN columns NATURAL JOIN titles NATURAL JOIN (
+                            SELECT table_id
+                            FROM columns
+                            WHERE type = 'text'
+                            GROUP BY table_id
+                            HAVING COUNT(DISTINCT col_id) >= ?
+                        )
+                        WHERE type = 'text'
+                        AND value IN {qmarks(p['textCol'])}
+                        GROUP BY table_id, col_id
+                        HAVING COUNT(*) >= ?"""
+    matchingTextParams = [p['numTextual'], *p['textCol'], p['slider'] * len(p['textCol'])]
+
+    matchingNumerical = """
+                        SELECT DISTINCT table_id, title
+                        FROM cells c NATURAL JOIN columns col NATURAL JOIN titles
+                        NATURAL JOIN
+                        (
+                            SELECT table_id
+                            FROM columns
+                            WHERE type = 'numerical'
+                            GROUP BY table_id
+                            HAVING COUNT(DISTINCT col_id) >= ?
+                        )
+                        WHERE col.type = 'numerical'
+                        AND c.location != 'header'
+                        AND c.value != ''
+                        GROUP BY table_id, col_id
+                        HAVING MAX(OVERLAP_SIM(?, toArr(value)), T_TEST(?, toArr(value))) >= ?"""
+    matchingNumericalParams = [p['numNumerical'], p['numCol'], p['numCol'], p['slider']]
+
+    matchingWidth = """
+                    SELECT table_id, title
+                    FROM cells NATURAL JOIN titles
+                    GROUP BY table_id
+                    HAVING MAX(col_id) >= ?"""
+    matchingWidthParams = [p['numCols'] - 1]
+
+    cases = "".join(f"WHEN {i} THEN {i}\n" for i in range(p['numCols']))
+
+    return [
+        ('keywordSearch', keyword_search_sql(p['keywords']), [*p['keywords'], *p['keywords']]),
+
+        ('postSeedSet', f"""
+            SELECT DISTINCT table_id, row_id, GROUP_CONCAT(value, ' || ') AS value
+            FROM cells c NATURAL JOIN ({customTable})
+            GROUP BY table_id, row_id;
+        """, []),
+
+        ('getMatchingTables.text', matchingText + ";", matchingTextParams),
+        ('getMatchingTables.numerical', matchingNumerical + ";", matchingNumericalParams),
+        ('getMatchingTables.width', matchingWidth + ";", matchingWidthParams),
+        ('getMatchingTables', f"""{matchingText}
+
+                        INTERSECT
+                    {matchingNumerical}
+
+                        INTERSECT
+                    {matchingWidth};
+        """, matchingTextParams + matchingNumericalParams + matchingWidthParams),
+
+        ('getTextualMatches', """
+                        SELECT table_id, col_id, toArr(value) AS column
+                        FROM cells c NATURAL JOIN columns col
+                        WHERE col.type = 'text'
+                        AND c.value != ''
+                        AND c.location != 'header'
+                        AND table_id = ?
+                        GROUP BY table_id, col_id
+        """, [p['table_id']]),
+
+        ('getNumericalMatches', """
+                        SELECT table_id, col_id, toArr(value) AS column
+                        FROM cells c NATURAL JOIN columns col
+                        WHERE col.type = 'numerical'
+                        AND c.value != ''
+                        AND c.location != 'header'
+                        AND table_id = ?
+                        GROUP BY table_id, col_id
+        """, [p['table_id']]),
+
+        ('getNULLMatches', """
+                            SELECT col_id
+                            FROM cells
+                            WHERE table_id = ?
+                            AND col_id NOT IN (0)
+                            GROUP BY col_id
+                            LIMIT ?;
+        """, [p['table_id'], 1]),
+
+        ('getPermutedRows', f"""
+                        SELECT GROUP_CONCAT(value, ' || ') AS value, title
+                        FROM titles NATURAL JOIN (
+                            SELECT table_id, row_id, CASE col_id {cases} ELSE {p['numCols']} END AS col_order, value
+                            FROM cells c
+                            WHERE table_id = ?
+                            AND c.location != 'header'
+                            ORDER BY table_id, row_id, col_order, value ASC
+                        )
+                        WHERE col_order != ?
+                        GROUP BY table_id, row_id
+        """, [p['table_id'], p['numCols']]),
+    ]
+
+
+def run_catalog(conn, params, runs=RUNS):
+    """
+    Runs every statement of the catalog, recording its query plan and latencies
+
+    Arguments:
+    conn: The connection to the database, with the server's functions registered
+    params: The parameters from 'sample_parameters'
+    runs: The number of timed executions of each statement
+
+    Returns:
+    A dictionary mapping the name of each statement to its 'plan' (the details of
+    EXPLAIN QUERY PLAN), its 'rows' and its 'p50', 'p95' and 'p99' latencies in ms
+    """
+    results = { }
+    for name, sql, args in catalog(params):
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, args)]
+        rows = len(conn.execute(sql, args).fetchall()) # Warm up the page cache
+
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            times.append((time.perf_counter() - start) * 1000)
+
+        p50, p95, p99 = np.percentile(times, [50, 95, 99])
+        results[name] = {'plan': plan, 'rows': rows, 'p50': p50, 'p95': p95, 'p99': p99}
+
+    return results
+
+
+def scans(plan):
+    """
+    Returns the steps of a query plan which scan a whole table or index
+    """
+    return {step for step in plan if step.startswith("SCAN ") and step != "SCAN CONSTANT ROW"}
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Compares the results of 'run_catalog' with a baseline
+
+    Arguments:
+    results: The results of the current run
+    baseline: The results of the baseline run
+    tolerance: The allowed ratio of the p95 latency of a statement to that of the baseline
+
+    Returns:
+    A list of descriptions of each regression, which is empty if there are none
+    """
+    failures = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+
+        for step in sorted(scans(result['plan']) - scans(base['plan'])):
+            failures.append("{0}: new full scan '{1}'".format(name, step))
+
+        if result['p95'] > base['p95'] * tolerance + SLACK:
+            failures.append("{0}: p95 latency {1:.2f}ms exceeds the baseline of {2:.2f}ms".format(name, result['p95'], base['p95']))
+
+    return failures
+
+
+def print_results(results):
+    """
+    Prints the query plan and latencies of every statement
+    """
+    for name, result in results.items():
+        print("{0} ({1} rows): p50 {2:.2f}ms, p95 {3:.2f}ms, p99 {4:.2f}ms".format(
+            name, result['rows'], result['p50'], result['p95'], result['p99']))
+        for step in result['plan']:
+            print("    " + step)
+    return
+
+
+if __name__ == "__main__":
+    main()
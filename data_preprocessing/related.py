@@ -0,0 +1,190 @@
+import sqlite3
+import argparse
+import os
+from pathlib import Path
+import numpy as np
+from scipy import sparse
+
+"""
+Precomputes the graph of related columns. The tables stored in the database
+do not change between builds, so rather than rediscovering the columns which
+overlap a seed set column on every expansion, the overlap between every pair
+of textual columns is computed once, after makeDB.py.
+
+Each textual column is a row of a sparse column x value incidence matrix A over
+the distinct normalized values of the column (from the trigram index built by
+makeDB), and so the number of values shared by every pair of columns is A * A^T.
+The product is computed a chunk of rows at a time, so that only one chunk of
+the (potentially dense) result is held in memory. For each column, the 'k'
+columns of other tables with the greatest overlap are kept, where the overlap
+is the fraction of the column's distinct values which appear in the related
+column, as 'overlapSim' on the server.
+
+Our schema is as follows:
+
+related_columns(table_id, col_id, rank, related_table_id, related_col_id, shared, overlap)
+"""
+
+TOP_K = 10
+CHUNK_SIZE = 1024
+
+
+def main():
+    filepath = os.path.dirname(os.path.realpath(__file__))
+    db_name = os.path.join(Path(filepath).parent, 'program', 'server', 'data', 'database.db')
+
+    parser = argparse.ArgumentParser(description="Precompute the related columns of every textual column.")
+    parser.add_argument("--db", default=db_name, help="path to database.db")
+    parser.add_argument("--top-k", type=int, default=TOP_K, help="number of related columns kept per column")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="number of columns multiplied at once")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    build_related_columns(conn, args.top_k, args.chunk_size)
+    conn.commit()
+    conn.close()
+    print("Finished building related columns")
+    return
+
+
+def build_related_columns(conn, k=TOP_K, chunkSize=CHUNK_SIZE):
+    """
+    Builds the 'related_columns' table from the 'text_value_cells' table of
+    the trigram index. Any previous table is replaced.
+
+    Arguments:
+    conn: The connection to the database
+    k: The number of related columns kept per column
+    chunkSize: The number of columns (rows of A) multiplied at once
+    """
+    c = conn.cursor()
+
+    c.execute("DROP TABLE IF EXISTS related_columns;")
+    c.execute("""CREATE TABLE related_columns(table_id integer, col_id integer, rank integer,
+                related_table_id integer, related_col_id integer, shared integer, overlap real,
+                PRIMARY KEY (table_id, col_id, rank)) WITHOUT ROWID;""")
+
+    columns, matrix = incidence_matrix(conn)
+    tableIDs = np.array([table_id for table_id, _ in columns], dtype=np.int64)
+    sizes = np.asarray(matrix.sum(axis=1)).ravel()
+    transposed = matrix.T.tocsc()
+
+    for start in range(0, len(columns), chunkSize):
+        shared = (matrix[start: start + chunkSize] @ transposed).tocsr()
+        c.executemany("INSERT INTO related_columns VALUES (?, ?, ?, ?, ?, ?, ?);",
+                      top_related(shared, start, columns, tableIDs, sizes, k))
+
+    print("Inserted into related_columns")
+    c.execute("CREATE INDEX idx_rc_related ON related_columns(related_table_id, related_col_id);")
+
+    return
+
+
+def incidence_matrix(conn):
+    """
+    Builds the column x value incidence matrix of the textual columns
+
+    Arguments:
+    conn: The connection to the database
+
+    Returns:
+    The (table_id, col_id) of each row, and the CSR matrix whose entry
+    (i, j) is 1 if the i'th column contains the value with value_id j
+    """
+    rows = conn.execute("""SELECT DISTINCT table_id, col_id, value_id
+                        FROM text_value_cells
+                        ORDER BY table_id, col_id;""").fetchall()
+    if len(rows) == 0:
+        return [], sparse.csr_matrix((0, 0), dtype=np.int32)
+
+    keys = np.array(rows, dtype=np.int64)
+    # The rows are sorted by column, so a new column starts wherever the key changes
+    starts = np.flatnonzero(np.any(np.diff(keys[:, :2], axis=0, prepend=-1), axis=1))
+    colIndex = np.repeat(np.arange(len(starts)), np.diff(starts, append=len(keys)))
+    columns = [(int(table_id), int(col_id)) for table_id, col_id in keys[starts, :2]]
+
+    matrix = sparse.csr_matrix((np.ones(len(keys), dtype=np.int32), (colIndex, keys[:, 2])),
+                               shape=(len(columns), int(keys[:, 2].max()) + 1))
+    return columns, matrix
+
+
+def top_related(shared, start, columns, tableIDs, sizes, k=TOP_K):
+    """
+    Selects the 'k' related columns of each column of a chunk
+
+    Arguments:
+    shared: The CSR matrix of the # of values shared by each column of the
+        chunk (rows) and every column (columns)
+    start: The index of the first column of the chunk
+    columns: The (table_id, col_id) of each column
+    tableIDs: The table_id of each column, as an array
+    sizes: The # of distinct values of each column
+    k: The number of related columns kept per column
+
+    Returns:
+    A generator of the rows of 'related_columns'
+    """
+    for i in range(shared.shape[0]):
+        idx = start + i
+        cols = shared.indices[shared.indptr[i]: shared.indptr[i + 1]]
+        counts = shared.data[shared.indptr[i]: shared.indptr[i + 1]]
+
+        # Columns of the same table are not related through the graph
+        other = tableIDs[cols] != tableIDs[idx]
+        cols, counts = cols[other], counts[other]
+        if len(cols) == 0:
+            continue
+
+        # Greatest overlap first, then the earliest column
+        order = np.lexsort((cols, -counts))[:k]
+        for rank, j in enumerate(order):
+            yield (*columns[idx], rank, *columns[cols[j]], int(counts[j]), float(counts[j] / sizes[idx]))
+
+
+def related_columns(conn, table_id, col_id):
+    """
+    Retrieves the related columns of a column
+
+    Arguments:
+    conn: The connection to the database
+    table_id: The table of the column
+    col_id: The column
+
+    Returns:
+    A list of (related_table_id, related_col_id, overlap) tuples in descending order of overlap
+    """
+    return conn.execute("""SELECT related_table_id, related_col_id, overlap
+                        FROM related_columns
+                        WHERE table_id = ?
+                        AND col_id = ?
+                        ORDER BY rank;""", (table_id, col_id)).fetchall()
+
+
+def candidate_tables(conn, columns, min_overlap=0):
+    """
+    Finds the tables related to the columns of a seed set through the graph. A
+    table is a candidate if it is related to any of the columns, and candidates
+    related to more of the columns are returned first.
+
+    Arguments:
+    conn: The connection to the database
+    columns: The (table_id, col_id) of the textual columns of the seed set
+    min_overlap: The minimum overlap of an edge of the graph
+
+    Returns:
+    A list of (table_id, # of columns related, total overlap) tuples
+    """
+    if len(columns) == 0:
+        return []
+
+    seed = " UNION ALL ".join(f"SELECT ? AS table_id, ? AS col_id, {i} AS seed_col" for i in range(len(columns)))
+    return conn.execute(f"""SELECT related_table_id, COUNT(DISTINCT seed_col), SUM(overlap)
+                        FROM related_columns NATURAL JOIN ({seed})
+                        WHERE overlap >= ?
+                        GROUP BY related_table_id
+                        ORDER BY COUNT(DISTINCT seed_col) DESC, SUM(overlap) DESC, related_table_id;""",
+                        [*(v for col in columns for v in col), min_overlap]).fetchall()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import sqlite3
+import os
+import sys
+import pytest
+
+# The modules of data_preprocessing are run as scripts, and import each other by name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import makeDB
+
+"""
+Fixtures shared by the tests. 'database' is a small database built by makeDB
+from the tables in TABLES, which include empty cells, repeated rows, and
+values which appear in the columns of several tables.
+"""
+
+TABLES = """title: New cities of Canada
+types: object, object, int64, float64
+header: 0
+"City", "Province", "Population", "Area"
+"New Westminster", "British Columbia", "78916", "15.6"
+"Halifax", "", "202102", "720.6"
+"Saskatoon", "Saskatchewan", "", "767.6"
+"Northriver", "Ontario", "45002", "413.2"
+
+title: Rivers of Canada
+types: object, object, int64
+header: 0
+"River", "Province", "Length"
+"North River", "Nova Scotia", "40"
+"South River", "Ontario", "120"
+"Fraser River", "British Columbia", "1375"
+"New River", "", "82"
+
+title: New York boroughs
+types: object, int64
+header: 0
+"Borough", "Population"
+"Brooklyn", "2736074"
+"Queens", ""
+"North Bronx", "1472654"
+
+title: Provinces
+types: object, object
+header: 0
+"Province", "Capital"
+"Ontario", "Toronto"
+"British Columbia", "Victoria"
+"Nova Scotia", "Halifax"
+"Saskatchewan", "Regina"
+"Saskatchewan", "Regina"
+
+title: Northern towns
+types: object, int64
+"North Bay", "51553"
+"North York", ""
+"Norwich", "11001"
+"Nortown", "2100"
+"""
+
+
+def build_database(path, text=TABLES, positions=False):
+    """
+    Builds a database at 'path' from the text of the tables, as makeDB.py
+    """
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    makeDB.create_tables(c, positions)
+    tables = [makeDB.parse_table(lines, i + 1, positions)
+              for i, lines in enumerate(makeDB.read_tables(text.splitlines(keepends=True)))]
+    makeDB.insert_tables(c, tables, positions=positions)
+    makeDB.build_indices(conn)
+    conn.commit()
+    return conn
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / "database.db")
+    conn = build_database(path)
+    yield path, conn
+    conn.close()
@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+import converter
+import makeText
+
+CSV = """City,Province,Population,Area (km2)
+New Westminster,British Columbia,78916,15.6
+Halifax,NULL,202102,720.6
+Saskatoon,Saskatchewan,-,767.6
+Northriver,Ontario,45002,nan
+Northriver,Ontario,45002,nan
+"""
+
+ARROW = pytest.param("string[pyarrow]", marks=pytest.mark.skipif(converter.STRING_DTYPE == object,
+                                                                  reason="pyarrow is not usable"))
+
+
+@pytest.fixture
+def table(tmp_path):
+    path = tmp_path / "cities.csv"
+    path.write_text(CSV, encoding='utf8')
+    return str(path)
+
+
+@pytest.mark.parametrize("dtype", [object, "string[python]", ARROW])
+def test_make_table(table, dtype, monkeypatch):
+    monkeypatch.setattr(converter, "STRING_DTYPE", object)
+    expected, _ = converter.Converter(filepath=table).makeTable(None, table)
+    expectedText = makeText.convert_file(table)
+
+    monkeypatch.setattr(converter, "STRING_DTYPE", dtype)
+    df, isMultiIndex = converter.Converter(filepath=table).makeTable(None, table)
+    assert not isMultiIndex
+    assert (df.dtypes == pd.Series([], dtype=dtype).dtype).all()
+    assert df.astype(object).equals(expected)
+    assert "" in df[1].tolist()
+    assert makeText.convert_file(table) == expectedText
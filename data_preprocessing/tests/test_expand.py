@@ -0,0 +1,114 @@
+import math
+import sqlite3
+import pytest
+import expand
+from conftest import build_database
+
+
+@pytest.fixture
+def expander(database):
+    path, _ = database
+    return expand.Expander(path)
+
+
+def test_extra_sliders_are_ignored(expander):
+    seed = {"tableIDs": [1, 1], "rowIDs": [1, 2]}
+    clipped = expand.expand_seed(expander, {**seed, "sliders": [50, 50, 50, 50, 100, 100]})
+    assert "error" not in clipped
+    assert clipped == expand.expand_seed(expander, {**seed, "sliders": [50, 50, 50, 50]})
+
+
+def test_failed_seed_is_reported(expander):
+    results = [expand.expand_seed(expander, seed) for seed in
+               [{"tableIDs": [1], "rowIDs": [1]}, {"tableIDs": [1]}, {"tableIDs": [2], "rowIDs": [1]}]]
+    assert "rows" in results[0] and "rows" in results[2]
+    assert results[1] == {"error": "KeyError: 'rowIDs'"}
+
+
+TABLES = """title: Cities
+types: object, int64, object
+header: 0
+"City", "Population", "Note"
+"Halifax", "100", ""
+"Regina", "200", ""
+"Toronto", "300", ""
+"Moncton", "150", "coastal"
+
+title: Towns
+types: object, object, int64
+header: 0
+"Town", "Region", "Population"
+"Halifax", "East", "120"
+"Regina", "West", "210"
+"Sydney", "East", "290"
+
+title: Villages
+types: object, int64, object
+header: 0
+"Village", "Population", "Note"
+"Sydney", "100.0", "a"
+"Gander", "200.0", "b"
+"""
+
+
+@pytest.fixture
+def towns(tmp_path):
+    path = str(tmp_path / "towns.db")
+    build_database(path, TABLES).close()
+    return path
+
+
+def test_text_filter_skipped_for_two_values(towns):
+    expander = expand.Expander(towns)
+
+    # Villages shares no value with the seed set, but with 2 values the server skips the filter
+    expander.postSeedSet([1, 1], [1, 2])
+    expander.seedSet["sliders"] = [50, 0, 50]
+    assert [t["table_id"] for t in expander.getMatchingTables()] == [1, 2, 3]
+
+    expander.postSeedSet([1, 1, 1], [1, 2, 3])
+    expander.seedSet["sliders"] = [50, 0, 50]
+    assert [t["table_id"] for t in expander.getMatchingTables()] == [1, 2]
+
+
+def test_no_textual_column_matches_nothing(towns):
+    expander = expand.Expander(towns)
+    expander.postSeedSet([1, 1, 1], [1, 2, 3])
+    expander.seedSet["sliders"] = [0, 50, 50]
+    assert expander.getMatchingTables() == []
+
+
+def test_numerical_overlap_compares_text(towns):
+    expander = expand.Expander(towns)
+    cols = {key: idx for idx, key in enumerate(expander.numCols)}
+
+    # "100.0" and "200.0" are equal to the seed values as numbers, but not as text
+    numbers = expander.numericalOverlap([100.0, 200.0])
+    text = expander.numericalOverlap([expand.js_string(100.0), expand.js_string(200.0)], expander.numTextMembers)
+    assert numbers[cols[(3, 1)]] == 1 and text[cols[(3, 1)]] == 0
+    assert numbers[cols[(1, 1)]] == 1 and text[cols[(1, 1)]] == 1
+
+
+def test_too_few_columns_for_nulls(towns):
+    seed = {"tableIDs": [1, 1, 1], "rowIDs": [1, 2, 3]}
+    assert len(expand.Expander(towns).expand(seed)["rows"]) > 0
+
+    # Without its Region column, Towns has no column left for the NULL column of the seed set
+    conn = sqlite3.connect(towns)
+    conn.execute("DELETE FROM cells WHERE table_id = 2 AND col_id = 1;")
+    conn.execute("DELETE FROM columns WHERE table_id = 2 AND col_id = 1;")
+    conn.commit()
+    conn.close()
+    assert expand.Expander(towns).expand(seed) == {"rows": [], "info": []}
+
+
+def test_bs25_empty_documents():
+    results = expand.bs25([("", "1-0"), ("", "1-1"), ("", "2-0")], ["Halifax"], k1=0.5, b=0.3)
+    assert [ids for ids, _ in results] == [["1-0", "1-1", "2-0"]]
+    assert all(math.isnan(score) for _, score in results)
+
+
+@pytest.mark.parametrize("value, string", [(1.0, "1"), (15.6, "15.6"), (1e-05, "0.00001"), (1.5e-07, "1.5e-7"),
+                                          (1e21, "1e+21"), (-2.5, "-2.5"), (None, "null")])
+def test_js_string(value, string):
+    assert expand.js_string(value) == string
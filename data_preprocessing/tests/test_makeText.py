@@ -0,0 +1,34 @@
+import pytest
+import makeText
+
+CSV = """City,Province,Population
+New Westminster,British Columbia,78916
+Halifax,Nova Scotia,202102
+Saskatoon,Saskatchewan,266141
+"""
+
+
+@pytest.fixture
+def paths(tmp_path):
+    paths = []
+    for i in range(4):
+        path = tmp_path / "cities{0}.csv".format(i)
+        path.write_text(CSV * (i + 1), encoding='utf8')
+        paths.append(str(path))
+    empty = tmp_path / "empty.csv"
+    empty.write_text("", encoding='utf8')
+    return makeText.schedule(paths + [str(empty)])
+
+
+@pytest.mark.parametrize("workers, timeLimit", [(1, None), (2, None), (1, 60), (2, 60)])
+def test_convert_all(paths, workers, timeLimit):
+    results = list(makeText.convert_all(paths, workers, timeLimit))
+    assert [path for path, _, _ in results] == paths
+
+    # Each file is converted as by convert_file, and the empty file is quarantined
+    for path, result, reason in results[:-1]:
+        assert reason is None
+        assert result == makeText.convert_file(path)
+    path, result, reason = results[-1]
+    assert path.endswith("empty.csv") and result is None
+    assert reason.startswith("EmptyDataError")
@@ -0,0 +1,40 @@
+import makeDB
+import phrase
+from conftest import build_database
+
+TABLES = """title: Rivers of _Nova Scotia
+types: object, int64
+caption: The longest rivers
+caption:
+caption: of the province
+header: 0
+"River", "Length"
+"North River", "40"
+"New River", "82"
+"""
+
+
+def test_caption_positions(tmp_path):
+    conn = build_database(str(tmp_path / "database.db"), TABLES, positions=True)
+    rows = conn.execute("""SELECT location, keyword, position FROM positions_title_caption
+                        ORDER BY location, position;""").fetchall()
+    assert [(keyword, position) for location, keyword, position in rows if location == 'caption'] == \
+        [(word, i) for i, word in enumerate("the longest rivers of the province".split())]
+    assert [(keyword, position) for location, keyword, position in rows if location == 'title'] == \
+        [(word, i) for i, word in enumerate("rivers of nova scotia".split())]
+
+    # A blank caption line is not a keyword, and a phrase continues across caption lines
+    assert conn.execute("SELECT COUNT(*) FROM keywords_title_caption WHERE keyword = '';").fetchone() == (0,)
+    assert phrase.phrase_titles(conn, "longest rivers of the") == [(1, 'caption')]
+    assert phrase.phrase_titles(conn, "of nova scotia") == [(1, 'title')]
+    conn.close()
+
+
+def test_positions_are_counted_per_location():
+    kwtc, postc, nextPosition = { }, { }, { }
+    makeDB.handle_keywords(kwtc, 1, 'caption', "first line", postc, nextPosition)
+    makeDB.handle_keywords(kwtc, 1, 'title', "a title", postc, nextPosition)
+    makeDB.handle_keywords(kwtc, 1, 'caption', "_second  line_", postc, nextPosition)
+    assert nextPosition == {'caption': 4, 'title': 2}
+    assert sorted(position for _, _, location, position in postc if location == 'caption') == [0, 1, 2, 3]
+    assert ('', 1, 'caption') not in kwtc
@@ -0,0 +1,50 @@
+import random
+import sqlite3
+import pytest
+import qgram
+
+
+def brute_force(conn, value, k, min_similarity):
+    """
+    The values within 'min_similarity' of 'value', verifying every value in the index
+    """
+    value = qgram.normalize_value(value)
+    results = []
+    for value_id, candidate in conn.execute("SELECT value_id, value FROM text_values;"):
+        sim = 1 - qgram.levenshtein(value, candidate) / max(len(value), len(candidate))
+        if sim >= min_similarity:
+            results.append((value_id, candidate, sim))
+    results.sort(key=lambda res: (-res[2], res[1]))
+    return results[:k]
+
+
+@pytest.fixture
+def random_values():
+    """
+    A trigram index over random short values, many of which share no q-gram
+    """
+    rng = random.Random(0)
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE columns(table_id integer, col_id integer, type text);")
+    conn.execute("CREATE TABLE cells(table_id integer, row_id integer, col_id integer, value text, location text);")
+    conn.execute("INSERT INTO columns VALUES (1, 0, 'text');")
+    words = ["north", "river", "new", "york", "bay", "south", "fraser", "nova", "scotia"]
+    values = {" ".join(rng.sample(words, rng.randint(1, 3))) for _ in range(200)}
+    values |= {"".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(rng.randint(1, 14))) for _ in range(300)}
+    conn.executemany("INSERT INTO cells VALUES (1, ?, 0, ?, 'cell');", enumerate(sorted(values)))
+    qgram.build_trigram_index(conn)
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize("min_similarity", [0.1, 0.3, 0.5, 0.8])
+@pytest.mark.parametrize("value", ["north river", "New  York", "bay", "x"])
+def test_similar_values_matches_brute_force(random_values, value, min_similarity):
+    expected = brute_force(random_values, value, 1000, min_similarity)
+    assert qgram.similar_values(random_values, value, 1000, min_similarity) == expected
+
+
+def test_similar_values_database(database):
+    _, conn = database
+    for value in ["north river", "Nortwon", "halifx"]:
+        assert qgram.similar_values(conn, value, 1000, 0.3) == brute_force(conn, value, 1000, 0.3)
@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import subprocess
+import pytest
+import querycache
+from queryplan import keyword_search_sql
+
+SERVER = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'program', 'server')
+
+
+def server_rows(conn, keywords):
+    """
+    The rows of Database.keywordSearch, including the mapping of empty cells in Database.all
+    """
+    rows = conn.execute(keyword_search_sql(keywords), [*keywords, *keywords]).fetchall()
+    return [{"table_id": table_id, "title": title, "row_id": row_id, "value": querycache.null_cells(value),
+             "rowCount": rowCount} for table_id, title, row_id, value, rowCount in rows]
+
+
+def cached_rows(conn, keywords):
+    row = conn.execute("SELECT results FROM query_cache WHERE query = ?;", (querycache.query_key(keywords),)).fetchone()
+    return json.loads(row[0])
+
+
+def by_table(rows):
+    tables = { }
+    for row in rows:
+        tables.setdefault(row["table_id"], []).append(row)
+    return tables
+
+
+def test_null_cells():
+    assert querycache.null_cells("a ||  || b") == "a || NULL || b"
+    assert querycache.null_cells("") == "NULL"
+    assert querycache.null_cells("a || b") == "a || b"
+
+
+@pytest.mark.parametrize("keywords", [["new"], ["north"], ["ontario", "new"]])
+def test_cache_matches_keyword_search(database, keywords):
+    path, conn = database
+    querycache.build_cache(path, querycache.read_log([", ".join(keywords)]), workers=1)
+
+    cached = cached_rows(conn, keywords)
+    assert len(cached) > 0
+    assert any("NULL" in row["value"] for row in cached)
+
+    # The cache holds every row the server returns, in the same order, so the
+    # client ranks a cache hit exactly as a live search
+    assert cached == server_rows(conn, keywords)
+    num_tables, = conn.execute("SELECT num_tables FROM query_cache;").fetchone()
+    assert num_tables == len(by_table(cached))
+
+
+def test_cache_matches_server(database):
+    """
+    Compares the cache with Database.keywordSearch in db.js, if the server's dependencies are installed
+    """
+    if shutil.which("node") is None or not os.path.isdir(os.path.join(SERVER, '..', 'node_modules', 'better-sqlite3')):
+        pytest.skip("the server's dependencies are not installed")
+
+    path, conn = database
+    keywords = ["new"]
+    script = """
+        const Database = require(process.argv[1]);
+        const db = new Database(process.argv[2]);
+        db.keywordSearch(JSON.parse(process.argv[3])).then((rows) => console.log(JSON.stringify(rows)));
+    """
+    output = subprocess.run(["node", "-e", script, os.path.join(SERVER, 'data', 'db.js'), path, json.dumps(keywords)],
+                            capture_output=True, text=True, check=True).stdout
+    live = json.loads(output.splitlines()[-1])
+
+    querycache.build_cache(path, querycache.read_log(["new"]), workers=1)
+    assert cached_rows(conn, keywords) == live
+
+
+def test_query_case_is_ignored(database):
+    path, conn = database
+    typed = querycache.parse_query("North River, Lake")
+    assert querycache.query_key(typed) == querycache.query_key(querycache.parse_query("north river,lake"))
+
+    querycache.build_cache(path, querycache.read_log(["North River, Lake", "north river,lake"]), workers=1)
+    assert conn.execute("SELECT COUNT(*), MAX(hits) FROM query_cache;").fetchone() == (1, 2)
+    assert cached_rows(conn, typed) == server_rows(conn, ["north river", "lake"])
+
+    querycache.build_cache(path, querycache.read_log(["New, ONTARIO"]), workers=1)
+    rows = cached_rows(conn, ["new", "ontario"])
+    assert len(rows) > 0
+    assert rows == cached_rows(conn, querycache.parse_query("new,ontario"))
+
+
+def test_eviction_keeps_most_frequent(database):
+    path, conn = database
+    log = ["new"] * 3 + ["north"] * 2 + ["ontario"]
+    querycache.build_cache(path, querycache.read_log(log), top=2, workers=1)
+    queries = {json.loads(query)[0]: hits for query, hits in conn.execute("SELECT query, hits FROM query_cache;")}
+    assert queries == {"new": 3, "north": 2}
@@ -98,6 +98,13 @@ class Database {
   keywordSearch(keywords) {
     var results = [];
     keywords = this.makeStrArr(keywords);
+
+    /* Frequent queries are precomputed by data_preprocessing/querycache.py */
+    var cached = this.getCachedSearch(keywords);
+    if (cached !== undefined) {
+      return Promise.resolve(cached);
+    }
+
     var keywordQMarks = this.getQMarks(keywords);
 
     /* Nested query is due to same keyword appearing in multiple
@@ -151,6 +158,32 @@ class Database {
     });
   }
 
+  /**
+   * Looks up the precomputed result of a keyword search in the 'query_cache'
+   * table. Entries computed for an earlier build of the database are ignored.
+   * @param {Array} keywords the array of keywords to search for.
+   * @return {Array | undefined} The rows of the top-ranked tables, or undefined if the query is not cached.
+   */
+  getCachedSearch(keywords) {
+    try {
+      const row = this.db
+        .prepare(
+          `
+            SELECT results
+            FROM query_cache q JOIN build_info b
+            ON b.key = 'version' AND q.build_version = b.value
+            WHERE q.query = ?;
+        `
+        )
+        .get(this.queryKey(keywords));
+
+      return row === undefined ? undefined : JSON.parse(row["results"]);
+    } catch (err) {
+      /* The cache has not been built for this database */
+      return undefined;
+    }
+  }
+
   /**
    * Sets the current seed set to be referenced later upon set expansion.
    * @param {String} tableIDs Stringified list of tableIDs of the seed set rows
@@ -1297,6 +1330,16 @@ class Database {
     return returned;
   }
 
+  /**
+   * The key of a keyword search in the 'query_cache' table: the JSON array
+   * of the distinct keywords in sorted order, as querycache.query_key.
+   * @param {Array} keywords the array of keywords
+   * @returns {String} The key of the query
+   */
+  queryKey(keywords) {
+    return JSON.stringify([...new Set(keywords)].sort());
+  }
+
   /**
    * Since the SQL arguments need to be an array,
    * if the argument passed to a method is a string (i.e. only one keyword)
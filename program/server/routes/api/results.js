@@ -3,7 +3,8 @@ const Database = require("../../data/db.js");
 
 const router = express.Router();
 
-const db = new Database("server/data/database.db");
+/* BARETQL_DB allows a different database to be served, i.e. by the load generator */
+const db = new Database(process.env.BARETQL_DB || "server/data/database.db");
 
 router.get("/keyword", (req, res) => {
   /* Route used when performing keyword searches */